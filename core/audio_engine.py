@@ -1,61 +1,370 @@
 import threading
-from typing import Optional
+from typing import Callable, Optional
 
 import numpy as np
 import soundfile as sf
 import sounddevice as sd
 
-from core.filters import peaking_eq_coeffs, BiquadState
+from core.filters import (
+    peaking_eq_coeffs,
+    BiquadState,
+    SmoothedBiquad,
+    OverlapSaveConvolver,
+    design_fir,
+    fir_latency_samples,
+)
+from core.dsp_graph import DspGraph, EqNode, GainNode, LimiterNode, MeterNode, SinkNode, SourceNode
+from core.loudness import DEFAULT_TARGET_LUFS, eq_loudness_delta_db, track_gain_db
+from core.pcm_cache import PcmCache
+from core.sample_format import MEMORY_MODES, storage_dtype, to_float32_into
+from core.signals import SignalSource
+from core.story_pack import StoryPack
+from core.tracing import tracer
+
+# "iir" — биквад по отсчётам; "fft" / "fft-linear" — вся кривая EQ одним FIR
+# через overlap-save свёртку (минимально- / линейно-фазовый)
+FILTER_ENGINES = ("iir", "fft", "fft-linear")
+FIR_TAPS = 2047
+
+# добротность полосы предпрослушивания ответа ("hear your guess")
+PREVIEW_Q = 1.4
+
+# configure_output(device=...) не передан — устройство не меняется
+# (None там означает системное устройство)
+KEEP_DEVICE = object()
+
+
+def output_devices() -> list[tuple[int, str]]:
+    """(индекс PortAudio, имя) устройств вывода на этой машине."""
+    result = []
+    for index, dev in enumerate(sd.query_devices()):
+        if dev.get("max_output_channels", 0) > 0:
+            result.append((index, dev.get("name", f"Device {index}")))
+    return result
+
+
+def resolve_output_device(name) -> Optional[int]:
+    """
+    Индекс устройства по сохранённому имени. Индексы PortAudio меняются
+    при подключении устройств и между машинами, поэтому в настройках
+    хранится имя; не нашли — None (системное устройство).
+    """
+    if not isinstance(name, str) or not name:
+        return None
+    try:
+        devices = output_devices()
+    except Exception as e:
+        print(f"[WARN] cannot list output devices: {e}")
+        return None
+    for index, dev_name in devices:
+        if dev_name == name:
+            return index
+    print(f"[WARN] output device {name!r} not found, using system default")
+    return None
 
 
 class AudioEngine:
-    def __init__(self):
+    def __init__(self, pcm_cache: Optional[PcmCache] = None):
         self.is_playing = False
         self.is_ab_original = False  # False = EQ, True = оригинал
 
         self._orig: Optional[np.ndarray] = None
+        self._source: Optional[SignalSource] = None  # генерируемый сигнал вместо трека
         self._samplerate: int = 44100
 
         self._thread: Optional[threading.Thread] = None
         self._stop_flag = False
+        self._pos = 0  # позиция воспроизведения трека, в кадрах
+
+        # сколько раз устройство не получило данные вовремя (за сессию)
+        self.underruns = 0
+
+        # граф обработки последнего запуска (для отчёта о стоимости узлов)
+        self._graph: Optional[DspGraph] = None
+        self._plan = None
 
         self._volume = 1.0  # 0.0–1.0
 
         self._eq_coeffs = None
         self._eq_state: Optional[BiquadState] = None
+        self._eq_conv: Optional[OverlapSaveConvolver] = None
+
+        self.filter_engine = "iir"
+
+        # выравнивание громкости: готовые множители из офлайн-анализа трека
+        # и АЧХ EQ — в аудиопотоке только умножение, без измерителей
+        self.loudness_match = True
+        self.target_lufs = DEFAULT_TARGET_LUFS
+        self._track_loudness: Optional[tuple[float, float]] = None  # (LUFS, true peak dBTP)
+        self._track_spectrum: Optional[tuple[list, list]] = None  # (bands_hz, spectrum_db) из пака
+        self._track_gain = 1.0
+        self._eq_comp_gains = (1.0, 1.0)  # (путь A, путь B)
+
+        # предпрослушивание ответа: UI пишет сюда последнюю (freq, gain),
+        # аудиопоток забирает её раз в блок — частые hover-события схлопываются
+        self._preview_target: Optional[tuple[float, float]] = None
+        self._preview_applied: Optional[tuple[float, float]] = None
+        self._preview_coeffs = None
+        self._preview_filter: Optional[SmoothedBiquad] = None
+
+        self._pcm_cache = pcm_cache
+        self._packs: dict[str, StoryPack] = {}  # открытые паки сюжетки (memmap)
+
+        # "float32" — как раньше; "compact" — хранить PCM в исходной разрядности
+        # (int16/int32) и переводить в float32 поблочно при воспроизведении
+        self.memory_mode = "float32"
+
+        # параметры вывода (см. настройки / автокалибровку)
+        self.block_size = 1024
+        self.device = None
+        self.target_latency_ms = 0.0
 
     def set_volume(self, volume: float):
         volume = max(0.0, min(1.0, float(volume)))
         self._volume = volume
 
+    def configure_output(self, block_size: Optional[int] = None, device=KEEP_DEVICE, target_latency_ms: Optional[float] = None):
+        # применяется при следующем открытии потока (play)
+        if block_size is not None:
+            self.block_size = max(16, int(block_size))
+        if device is not KEEP_DEVICE:
+            self.device = device
+        if target_latency_ms is not None:
+            self.target_latency_ms = max(0.0, float(target_latency_ms))
+
+    def set_memory_mode(self, mode: str):
+        # применяется к следующему load_file
+        if mode in MEMORY_MODES:
+            self.memory_mode = mode
+
+    def memory_footprint(self) -> dict:
+        if self._orig is None:
+            # генерируемый сигнал в памяти не хранится
+            return {"mode": self.memory_mode, "dtype": None, "bytes": 0, "float32_bytes": 0}
+        return {
+            "mode": self.memory_mode,
+            "dtype": self._orig.dtype.name,
+            "bytes": int(self._orig.nbytes),
+            "float32_bytes": int(self._orig.size * 4),
+        }
+
+    @property
+    def samplerate(self) -> int:
+        return self._samplerate
+
+    @property
+    def channels(self) -> int:
+        if self._source is not None:
+            return self._source.channels
+        return int(self._orig.shape[1]) if self._orig is not None else 2
+
+    @property
+    def has_audio(self) -> bool:
+        return self._orig is not None or self._source is not None
+
+    @property
+    def alive(self) -> bool:
+        # поток воспроизведения создаётся на каждый play — умирать нечему
+        return True
+
+    def set_filter_engine(self, engine: str):
+        if engine not in FILTER_ENGINES or engine == self.filter_engine:
+            return
+        self.filter_engine = engine
+        # пересобираем текущий EQ под новый движок
+        if self.has_audio and self._eq_coeffs is not None:
+            self._build_eq(self.channels)
+
+    def _make_convolver(self, coeffs, channels: int, engine: Optional[str] = None) -> OverlapSaveConvolver:
+        linear = (engine or self.filter_engine) == "fft-linear"
+        fir = design_fir([coeffs], FIR_TAPS, linear_phase=linear)
+        return OverlapSaveConvolver(fir, self.block_size, channels, fir_latency_samples(fir, linear))
+
+    def _build_eq(self, channels: int):
+        if self.filter_engine == "iir":
+            self._eq_state = BiquadState(channels)
+            self._eq_conv = None
+        else:
+            self._eq_state = None
+            self._eq_conv = self._make_convolver(self._eq_coeffs, channels)
+
+    def _process_eq(self, chunk: np.ndarray) -> np.ndarray:
+        if self._eq_conv is not None:
+            return self._eq_conv.process_block(chunk)
+        if self._eq_coeffs is not None and self._eq_state is not None:
+            return self._eq_state.process_block(chunk, self._eq_coeffs)
+        return chunk
+
+    def set_loudness_match(self, enabled: bool, target_lufs: Optional[float] = None):
+        self.loudness_match = bool(enabled)
+        if target_lufs is not None:
+            self.target_lufs = float(target_lufs)
+        self._update_track_gain()
+
+    def set_track_loudness(self, integrated_lufs: Optional[float], true_peak_db: Optional[float]):
+        # результат LoudnessIndex для текущего трека (None — ещё не посчитан)
+        if integrated_lufs is None or true_peak_db is None:
+            self._track_loudness = None
+        else:
+            self._track_loudness = (float(integrated_lufs), float(true_peak_db))
+        self._update_track_gain()
+
+    def _update_track_gain(self):
+        if self._track_loudness is None:
+            self._track_gain = 1.0
+            return
+        gain_db = track_gain_db(*self._track_loudness, target_lufs=self.target_lufs)
+        self._track_gain = 10.0 ** (gain_db / 20.0)
+
+    def _update_eq_compensation(self):
+        # громкость выравниваем только ослаблением более громкого пути:
+        # подъём EQ — тише B, вырез — тише A. Усиление поверх _track_gain
+        # вывело бы true peak за потолок, и лимитер исказил бы только B
+        bands, spectrum = self._track_spectrum or (None, None)
+        delta_db = eq_loudness_delta_db([self._eq_coeffs], self._samplerate, bands, spectrum)
+        comp = 10.0 ** (-abs(delta_db) / 20.0)
+        self._eq_comp_gains = (comp, 1.0) if delta_db < 0.0 else (1.0, comp)
+
+    def _loudness_gain(self) -> float:
+        if not self.loudness_match:
+            return 1.0
+        comp_a, comp_b = self._eq_comp_gains
+        return self._track_gain * (comp_a if self.is_ab_original else comp_b)
+
+    def set_preview(self, freq_hz: float, gain_db: float):
+        # только присваивание ссылки — безопасно вызывать с частотой мыши
+        self._preview_target = (float(freq_hz), float(gain_db))
+
+    def clear_preview(self):
+        # плавно уводим полосу в 0 dB вместо резкого выключения
+        target = self._preview_target
+        if target is not None:
+            self._preview_target = (target[0], 0.0)
+
+    def _process_preview(self, chunk: np.ndarray) -> np.ndarray:
+        target = self._preview_target
+        if target is None:
+            return chunk
+
+        if target != self._preview_applied:
+            # не чаще одного пересчёта коэффициентов на блок
+            self._preview_applied = target
+            self._preview_coeffs = peaking_eq_coeffs(self._samplerate, target[0], PREVIEW_Q, target[1])
+
+        channels = chunk.shape[1]
+        flt = self._preview_filter
+        if flt is None or len(flt.x1) != channels:
+            # старт с 0 dB на частоте полосы: clear_preview() сразу после
+            # нового раунда не гоняет лишний блок интерполяции
+            flt = SmoothedBiquad(channels, peaking_eq_coeffs(self._samplerate, target[0], PREVIEW_Q, 0.0))
+            self._preview_filter = flt
+
+        # полоса ушла в 0 dB и успокоилась — не тратим CPU
+        if target[1] == 0.0 and flt.is_settled(self._preview_coeffs):
+            return chunk
+
+        return flt.process_block(chunk, self._preview_coeffs)
+
+    def eq_latency_ms(self) -> float:
+        if self._eq_conv is None:
+            return 0.0
+        return self._eq_conv.latency_ms(self._samplerate)
+
+    def make_eq_processor(
+        self,
+        channels: int,
+        freq_hz: float = 1000.0,
+        q: float = 1.0,
+        gain_db: float = 12.0,
+        engine: Optional[str] = None,
+    ):
+        # отдельный экземпляр фильтра (по умолчанию текущего движка) — для замеров стоимости DSP
+        engine = engine or self.filter_engine
+        coeffs = peaking_eq_coeffs(self._samplerate, freq_hz, q, gain_db)
+        if engine != "iir":
+            return self._make_convolver(coeffs, channels, engine).process_block
+        state = BiquadState(channels)
+        return lambda x: state.process_block(x, coeffs)
+
     def load_file(self, path: str):
-        data, sr = sf.read(path, always_2d=True, dtype="float32")
+        dtype = storage_dtype(path, self.memory_mode)
+        with tracer.span("audio.load_file", cat="audio", cached=self._pcm_cache is not None):
+            if self._pcm_cache is not None:
+                # повторно открытый трек берётся из кэша как memmap, без декодера
+                data, sr = self._pcm_cache.load(path, dtype=dtype)
+            else:
+                data, sr = sf.read(path, always_2d=True, dtype=dtype)
         self._samplerate = int(sr)
         self._orig = data
+        self._source = None
+        self._track_spectrum = None
+        self.set_track_loudness(None, None)
+
+        self._reset_eq()
+
+    def open_pack(self, pack_path: str) -> StoryPack:
+        pack = self._packs.get(pack_path)
+        if pack is None:
+            pack = StoryPack(pack_path)
+            self._packs[pack_path] = pack
+        return pack
+
+    def load_pack_track(self, pack_path: str, index: int):
+        # отрывок уже декодирован и приведён к частоте пака — только view на memmap
+        with tracer.span("audio.load_pack_track", cat="audio", index=index):
+            pack = self.open_pack(pack_path)
+            track = pack.tracks[index]
+            self._samplerate = pack.samplerate
+            self._orig = pack.audio(index)
+            self._source = None
+            # громкость и спектр посчитаны при сборке пака
+            self._track_spectrum = (pack.bands_hz, track.spectrum_db) if pack.bands_hz else None
+            self.set_track_loudness(track.integrated_lufs, track.true_peak_db)
 
-        # сброс EQ состояния при загрузке нового файла
+        self._reset_eq()
+
+    def load_source(self, source: SignalSource):
+        # тестовый сигнал играет как трек, но генерируется поблочно без диска
+        source.reset()
+        self._samplerate = source.samplerate
+        self._source = source
+        self._orig = None
+        self._track_spectrum = None
+        self.set_track_loudness(None, None)
+
+        self._reset_eq()
+
+    def _reset_eq(self):
+        # сброс EQ состояния при загрузке нового файла / сигнала
         self._eq_coeffs = None
         self._eq_state = None
+        self._eq_conv = None
+        self._eq_comp_gains = (1.0, 1.0)
+        self._preview_filter = None
+        self._preview_applied = None
 
     def set_peaking_eq(self, freq_hz: float, q: float, gain_db: float):
-        if self._orig is None:
+        if not self.has_audio:
             return
 
-        self._eq_coeffs = peaking_eq_coeffs(self._samplerate, freq_hz, q, gain_db)
-        channels = int(self._orig.shape[1])
-        self._eq_state = BiquadState(channels)
+        with tracer.span("audio.set_peaking_eq", cat="audio", engine=self.filter_engine):
+            self._eq_coeffs = peaking_eq_coeffs(self._samplerate, freq_hz, q, gain_db)
+            self._build_eq(self.channels)
+            self._update_eq_compensation()
 
     def play(self):
-        if self._orig is None:
+        if not self.has_audio:
             return
         if self.is_playing:
             return
 
         self._stop_flag = False
+        self._pos = 0
         self.is_playing = True
 
-        self._thread = threading.Thread(target=self._play_loop, daemon=True)
-        self._thread.start()
+        with tracer.span("audio.thread_start", cat="audio"):
+            self._thread = threading.Thread(target=self._play_loop, daemon=True)
+            self._thread.start()
 
     def stop(self):
         if not self.is_playing:
@@ -67,50 +376,138 @@ class AudioEngine:
         except Exception:
             pass
 
+        # дожидаемся выхода из _play_loop, иначе быстрый play() после stop()
+        # сбросит флаг и старый поток продолжит играть
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
         self.is_playing = False
 
+    def close(self):
+        self.stop()
+
     def toggle_play(self):
         if self.is_playing:
             self.stop()
         else:
             self.play()
 
+    def set_ab_original(self, original: bool):
+        if bool(original) != self.is_ab_original:
+            self.toggle_ab()
+
     def toggle_ab(self):
         self.is_ab_original = not self.is_ab_original
 
-        # чтобы при переключении A/B не было “хвоста” состояния фильтра
-        if not self.is_ab_original and self._orig is not None and self._eq_coeffs is not None:
-            self._eq_state = BiquadState(int(self._orig.shape[1]))
+        # чтобы при переключении A/B не было “хвоста” состояния фильтра;
+        # FFT-свёртку не сбрасываем — в режиме A её история идёт через bypass,
+        # иначе после переключения линейная фаза первые ~23 ms видит нули
+        if not self.is_ab_original and self.has_audio and self._eq_coeffs is not None:
+            if self._eq_conv is None:
+                self._eq_state = BiquadState(self.channels)
+
+        # то же для полосы предпрослушивания; коэффициенты остаются текущими, без рампы
+        if self.is_ab_original and self.has_audio and self._preview_filter is not None:
+            self._preview_filter = SmoothedBiquad(self.channels, self._preview_filter.current)
+
+    def _fill_block(self, buf: np.ndarray) -> int:
+        # чтение трека/сигнала прямо в общий буфер графа
+        if self._source is not None:
+            buf[...] = self._source.read(buf.shape[0])
+            return buf.shape[0]
+
+        frames = self._orig.shape[0]
+        if self._pos >= frames:
+            self._pos = 0
+
+        end = min(self._pos + buf.shape[0], frames)
+        n = end - self._pos
+        to_float32_into(self._orig[self._pos:end], buf[:n])
+        self._pos = end
+        return n
+
+    def _apply_path_eq(self, chunk: np.ndarray) -> np.ndarray:
+        # применяем EQ только в режиме B (EQ); в режиме A — полосу
+        # предпрослушивания ответа, чтобы A/B сравнивал догадку с правдой
+        if not self.is_ab_original:
+            return self._process_eq(chunk)
+        if self._eq_conv is not None:
+            # A с той же задержкой, что и FIR: пути совпадают по времени
+            chunk = self._eq_conv.bypass_block(chunk)
+        return self._process_preview(chunk)
+
+    def build_graph(self, sink: Optional[Callable[[np.ndarray], None]] = None, with_volume: bool = True) -> DspGraph:
+        # общий код для потока и DSP-процесса; новые стадии добавляются сюда
+        nodes = [
+            SourceNode("source", self._fill_block),
+            EqNode("eq", self._apply_path_eq),
+            # сливается с volume в одно умножение (см. DspGraph.compile)
+            GainNode("loudness", self._loudness_gain),
+        ]
+        if with_volume:
+            nodes.append(GainNode("volume", lambda: self._volume))
+        nodes.append(LimiterNode("limiter"))
+        nodes.append(MeterNode("meter"))
+        if sink is not None:
+            nodes.append(SinkNode("sink", sink))
+
+        self._graph = DspGraph(nodes)
+        return self._graph
+
+    def dsp_report(self) -> dict:
+        if self._plan is None or self._graph is None:
+            return {}
+        report = self._plan.report()
+        limiter = self._graph.node("limiter")
+        meter = self._graph.node("meter")
+        if limiter is not None:
+            report["limiter_clipped_blocks"] = limiter.clipped_blocks
+        if meter is not None:
+            report["meter_peak_db"] = round(meter.peak_db, 1)
+            report["meter_rms_db"] = round(meter.rms_db, 1)
+        report["loudness_gain_db"] = round(float(20.0 * np.log10(max(self._loudness_gain(), 1e-9))), 2)
+        return report
 
     def _play_loop(self):
-        if self._orig is None:
+        if not self.has_audio:
             self.is_playing = False
             return
 
-        frames, channels = self._orig.shape
-        block_size = 1024
+        channels = self.channels
+        block_size = self.block_size
+        latency = self.target_latency_ms / 1000.0 if self.target_latency_ms > 0 else None
 
         try:
-            with sd.OutputStream(
-                samplerate=self._samplerate,
-                channels=channels,
-                dtype="float32",
-            ) as stream:
-                idx = 0
-                while not self._stop_flag:
-                    if idx >= frames:
-                        idx = 0
+            with tracer.span("audio.stream_open", cat="audio", block_size=block_size):
+                stream = sd.OutputStream(
+                    samplerate=self._samplerate,
+                    channels=channels,
+                    dtype="float32",
+                    blocksize=block_size,
+                    device=self.device,
+                    latency=latency,
+                )
 
-                    end = min(idx + block_size, frames)
-                    chunk = self._orig[idx:end]
-                    idx = end
+            # __enter__ запускает поток (Pa_StartStream), открытие устройства — выше
+            with stream:
+                written = 0
 
-                    # применяем EQ только в режиме B (EQ)
-                    if (not self.is_ab_original) and (self._eq_coeffs is not None) and (self._eq_state is not None):
-                        chunk = self._eq_state.process_block(chunk, self._eq_coeffs)
+                def sink(x: np.ndarray):
+                    nonlocal written
+                    underflowed = stream.write(x)
+                    if written == 0:
+                        tracer.first_sound()
+                    # первые блоки уходят до заполнения буфера устройства
+                    if underflowed and written >= 2:
+                        self.underruns += 1
+                    written += 1
 
-                    stream.write(chunk * self._volume)
-        except Exception:
-            pass
+                self._plan = self.build_graph(sink).compile(block_size, channels)
+                while not self._stop_flag:
+                    self._plan.run_block()
+        except Exception as e:
+            # иначе недоступное устройство выглядит как «Play ничего не делает»
+            print(f"[WARN] playback stopped: {e}")
 
         self.is_playing = False
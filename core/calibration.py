@@ -0,0 +1,132 @@
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import numpy as np
+import sounddevice as sd
+
+from core.signals import PinkNoise
+
+BLOCK_SIZES = [64, 128, 256, 512, 1024, 2048, 4096]
+
+
+@dataclass
+class CalibrationResult:
+    block_size: int
+    samplerate: int
+    safety_margin: float
+    dsp_cost_ms: dict[int, float] = field(default_factory=dict)
+    device_stable: dict[int, bool] = field(default_factory=dict)
+    device_latency_ms: dict[int, float] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        lines = []
+        for bs in sorted(self.dsp_cost_ms):
+            budget = bs / self.samplerate * 1000.0
+            stable = self.device_stable.get(bs)
+            lines.append(
+                f"{bs:>5}: DSP {self.dsp_cost_ms[bs]:.2f} ms / {budget:.2f} ms"
+                + ("" if stable is None else (" | ok" if stable else " | underrun"))
+            )
+        return "\n".join(lines)
+
+
+def measure_dsp_cost(
+    process: Callable[[np.ndarray], np.ndarray],
+    block_size: int,
+    channels: int,
+    n_blocks: int = 16,
+) -> float:
+    """Медиана времени обработки одного блока, в секундах."""
+    # воспроизводимый сигнал с музыкальным спектром, без чтения файлов
+    x = PinkNoise(channels=channels, seed=0).read(block_size)
+
+    # прогрев (аллокации, кэши)
+    process(x)
+
+    times = []
+    for _ in range(n_blocks):
+        t0 = time.perf_counter()
+        process(x)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def probe_device(
+    block_size: int,
+    samplerate: int,
+    channels: int,
+    device=None,
+    latency: Optional[float] = None,
+    seconds: float = 0.5,
+) -> tuple[bool, float]:
+    """
+    Проигрывает тишину блоками block_size и считает underrun'ы.
+    Возвращает (стабильно ли, фактическая латентность потока в мс).
+    """
+    silence = np.zeros((block_size, channels), dtype=np.float32)
+    n_blocks = max(4, int(seconds * samplerate / block_size))
+    underruns = 0
+
+    with sd.OutputStream(
+        samplerate=samplerate,
+        channels=channels,
+        dtype="float32",
+        blocksize=block_size,
+        device=device,
+        latency=latency,
+    ) as stream:
+        for i in range(n_blocks):
+            underflowed = stream.write(silence)
+            # первые блоки до заполнения буфера не считаем
+            if underflowed and i >= 2:
+                underruns += 1
+        stream_latency = float(stream.latency)
+
+    return underruns == 0, stream_latency * 1000.0
+
+
+def calibrate_block_size(
+    process_factory: Callable[[], Callable[[np.ndarray], np.ndarray]],
+    samplerate: int,
+    channels: int = 2,
+    safety_margin: float = 0.5,
+    device=None,
+    latency: Optional[float] = None,
+    probe_output: bool = True,
+) -> CalibrationResult:
+    """
+    Подбирает наименьший block_size, при котором обработка блока
+    с запасом safety_margin укладывается в его длительность
+    и устройство играет без underrun'ов.
+    """
+    result = CalibrationResult(
+        block_size=BLOCK_SIZES[-1],
+        samplerate=int(samplerate),
+        safety_margin=float(safety_margin),
+    )
+
+    for bs in BLOCK_SIZES:
+        # у фильтра есть состояние — на каждый размер свой экземпляр
+        cost = measure_dsp_cost(process_factory(), bs, channels)
+        result.dsp_cost_ms[bs] = cost * 1000.0
+
+        budget = bs / samplerate
+        if cost * (1.0 + safety_margin) > budget:
+            continue
+
+        if probe_output:
+            try:
+                stable, dev_latency_ms = probe_device(bs, samplerate, channels, device, latency)
+            except Exception as e:
+                print(f"[WARN] device probe failed for block {bs}: {e}")
+                stable, dev_latency_ms = False, 0.0
+            result.device_stable[bs] = stable
+            result.device_latency_ms[bs] = dev_latency_ms
+            if not stable:
+                continue
+
+        result.block_size = bs
+        break
+
+    return result
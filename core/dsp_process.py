@@ -0,0 +1,525 @@
+"""
+Вынос аудио из процесса UI.
+
+DSP-процесс декодирует и фильтрует (тот же граф AudioEngine.build_graph), пишет
+готовые блоки в кольцевой буфер multiprocessing.shared_memory; процесс
+вывода забирает их оттуда в callback'е sounddevice. Ни один из них не делит
+GIL с Qt, поэтому зависания UI не дают выпадений звука.
+
+Команды идут через лёгкие очереди; то, что меняется часто (громкость,
+полоса предпрослушивания), пишется прямо в заголовок в общей памяти.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from core.audio_engine import KEEP_DEVICE, AudioEngine, FILTER_ENGINES, FIR_TAPS
+from core.filters import peaking_eq_coeffs
+from core.pcm_cache import PcmCache
+from core.sample_format import storage_dtype
+from core.signals import SignalSource
+from core.tracing import tracer
+
+ENGINE_MODES = ("thread", "process")
+
+MAX_CHANNELS = 8
+RING_FRAMES = 1 << 16
+
+# заголовок: int64-слоты
+WRITE_POS = 0   # кадров записано DSP-процессом (монотонно)
+READ_POS = 1    # кадров прочитано процессом вывода (монотонно)
+UNDERRUNS = 2
+CHANNELS = 3
+TARGET_FILL = 4  # сколько кадров держать готовыми в кольце
+PREVIEW_SEQ = 5  # растёт при каждом новом значении предпрослушивания
+SOUND_SEQ = 6    # растёт, когда процесс вывода отдал устройству первый блок после open
+DSP_ERRORS = 7   # ошибки в DSP-процессе (воспроизведение после них остановлено)
+INT_SLOTS = 8
+
+# float64-слоты (после int64)
+VOLUME = 0
+PREVIEW_FREQ = 1
+PREVIEW_GAIN = 2
+FIRST_SOUND_T = 3  # perf_counter() первого непустого блока (для трассировки)
+FLOAT_SLOTS = 4
+
+HEADER_BYTES = (INT_SLOTS + FLOAT_SLOTS) * 8
+
+
+class _SharedRing:
+    def __init__(self, header_name: Optional[str] = None, ring_name: Optional[str] = None,
+                 ring_frames: int = RING_FRAMES):
+        create = header_name is None
+        self._header_shm = shared_memory.SharedMemory(name=header_name, create=create, size=HEADER_BYTES)
+        self._ring_shm = shared_memory.SharedMemory(
+            name=ring_name, create=create, size=ring_frames * MAX_CHANNELS * 4
+        )
+        self.owner = create
+        self.ring_frames = ring_frames
+
+        buf = self._header_shm.buf
+        self.ints = np.ndarray((INT_SLOTS,), dtype=np.int64, buffer=buf)
+        self.floats = np.ndarray((FLOAT_SLOTS,), dtype=np.float64, buffer=buf, offset=INT_SLOTS * 8)
+        self.ring = np.ndarray((ring_frames, MAX_CHANNELS), dtype=np.float32, buffer=self._ring_shm.buf)
+
+        if create:
+            self.ints[:] = 0
+            self.floats[:] = 0.0
+            self.floats[VOLUME] = 1.0
+
+    @property
+    def names(self) -> tuple[str, str]:
+        return self._header_shm.name, self._ring_shm.name
+
+    def write(self, chunk: np.ndarray):
+        chunk = chunk[:, :MAX_CHANNELS]
+        n, ch = chunk.shape
+        start = int(self.ints[WRITE_POS]) % self.ring_frames
+        first = min(n, self.ring_frames - start)
+        self.ring[start:start + first, :ch] = chunk[:first]
+        if first < n:
+            self.ring[:n - first, :ch] = chunk[first:]
+        # позицию двигаем только после копирования данных
+        self.ints[WRITE_POS] += n
+
+    def read_into(self, out: np.ndarray) -> int:
+        frames, ch = out.shape
+        avail = int(self.ints[WRITE_POS] - self.ints[READ_POS])
+        n = max(0, min(frames, avail))
+        start = int(self.ints[READ_POS]) % self.ring_frames
+        first = min(n, self.ring_frames - start)
+        out[:first] = self.ring[start:start + first, :ch]
+        if first < n:
+            out[first:n] = self.ring[:n - first, :ch]
+        self.ints[READ_POS] += n
+        return n
+
+    def close(self):
+        # ссылки на буфер надо отпустить до close(), иначе BufferError
+        self.ints = self.floats = self.ring = None
+        self._header_shm.close()
+        self._ring_shm.close()
+        if self.owner:
+            self._header_shm.unlink()
+            self._ring_shm.unlink()
+
+
+# ── процессы ───────────────────────────────────────────────────────
+
+def _dsp_worker_main(header_name: str, ring_name: str, ring_frames: int,
+                     commands: multiprocessing.Queue, acks: multiprocessing.Queue,
+                     cache_dir: Optional[str]):
+    ring = _SharedRing(header_name, ring_name, ring_frames)
+    engine = AudioEngine(pcm_cache=PcmCache(cache_dir) if cache_dir else None)
+    playing = False
+    preview_seq = 0
+    plan = None
+
+    while True:
+        try:
+            msg = commands.get(timeout=0.05) if not playing else commands.get_nowait()
+        except queue.Empty:
+            msg = None
+
+        if msg is not None:
+            cmd = msg[0]
+            if cmd == "quit":
+                if tracer.enabled:
+                    acks.put(("trace", "dsp", tracer.export_events()))
+                break
+            if cmd == "play":
+                engine._pos = 0
+                try:
+                    # громкость применяет процесс вывода — здесь граф без gain
+                    plan = engine.build_graph(ring.write, with_volume=False).compile(engine.block_size, engine.channels)
+                except Exception:
+                    _dsp_error(ring, "play")
+                    continue
+                engine._plan = plan
+                playing = True
+            elif cmd == "stop":
+                playing = False
+                acks.put("dsp")
+            elif cmd == "call":
+                _, name, args = msg
+                try:
+                    getattr(engine, name)(*args)
+                except Exception as e:
+                    print(f"[DSP] {name} failed: {e}")
+            continue
+
+        if not playing:
+            continue
+        if not engine.has_audio:
+            time.sleep(0.01)
+            continue
+
+        # предпрослушивание: берём последнее значение из общей памяти
+        seq = int(ring.ints[PREVIEW_SEQ])
+        if seq != preview_seq:
+            preview_seq = seq
+            engine.set_preview(float(ring.floats[PREVIEW_FREQ]), float(ring.floats[PREVIEW_GAIN]))
+
+        block = plan.block_size
+        fill = int(ring.ints[WRITE_POS] - ring.ints[READ_POS])
+        if fill + block > int(ring.ints[TARGET_FILL]):
+            # кольцо заполнено — ждём четверть блока
+            time.sleep(block / engine.samplerate / 4.0)
+            continue
+
+        try:
+            plan.run_block()
+        except Exception:
+            # процесс живёт дальше и принимает команды, но этот запуск остановлен
+            _dsp_error(ring, "run_block")
+            playing = False
+
+    ring.close()
+
+
+def _dsp_error(ring: _SharedRing, where: str):
+    print(f"[DSP] {where} failed:\n{traceback.format_exc()}")
+    ring.ints[DSP_ERRORS] += 1
+
+
+def _output_worker_main(header_name: str, ring_name: str, ring_frames: int,
+                        commands: multiprocessing.Queue, acks: multiprocessing.Queue):
+    import sounddevice as sd
+
+    ring = _SharedRing(header_name, ring_name, ring_frames)
+    stream = None
+    primed = False
+
+    def callback(outdata, frames, time_info, status):
+        nonlocal primed
+        n = ring.read_into(outdata)
+        if n and not primed:
+            primed = True
+            ring.floats[FIRST_SOUND_T] = time.perf_counter()
+            ring.ints[SOUND_SEQ] += 1
+        if n < frames:
+            outdata[n:] = 0.0
+            # пустое кольцо до прихода первых данных — это не выпадение
+            if primed:
+                ring.ints[UNDERRUNS] += 1
+        elif status.output_underflow:
+            ring.ints[UNDERRUNS] += 1
+        outdata *= ring.floats[VOLUME]
+
+    while True:
+        msg = commands.get()
+        cmd = msg[0]
+
+        if cmd in ("close", "quit") and stream is not None:
+            stream.stop()
+            stream.close()
+            stream = None
+        if cmd == "close":
+            acks.put("output")
+        elif cmd == "quit":
+            if tracer.enabled:
+                acks.put(("trace", "output", tracer.export_events()))
+            break
+        elif cmd == "open":
+            _, samplerate, channels, block_size, device, latency = msg
+            primed = False
+            try:
+                with tracer.span("audio.stream_open", cat="audio", block_size=block_size):
+                    stream = sd.OutputStream(
+                        samplerate=samplerate,
+                        channels=channels,
+                        dtype="float32",
+                        blocksize=block_size,
+                        device=device,
+                        latency=latency,
+                        callback=callback,
+                    )
+                    stream.start()
+            except Exception as e:
+                print(f"[OUT] cannot open stream: {e}")
+                stream = None
+
+    ring.close()
+
+
+# ── фасад для UI ───────────────────────────────────────────────────
+
+class ProcessAudioEngine(AudioEngine):
+    """
+    Тот же интерфейс, что у AudioEngine, но звук считается и выводится
+    в отдельных процессах. В процессе UI остаются только метаданные трека.
+    """
+
+    def __init__(self, pcm_cache: Optional[PcmCache] = None, ring_frames: int = RING_FRAMES):
+        self._dsp_commands = None
+        super().__init__(pcm_cache=None)
+
+        self._loaded = False
+        self._meta_channels = 2
+        self._meta_frames = 0
+        self._meta_path: Optional[str] = None
+        self._meta_dtype: Optional[np.dtype] = None  # для трека из пака
+
+        ctx = multiprocessing.get_context("spawn")
+        self._ring = _SharedRing(ring_frames=ring_frames)
+        header_name, ring_name = self._ring.names
+
+        self._dsp_commands = ctx.Queue()
+        self._out_commands = ctx.Queue()
+        self._acks = ctx.Queue()
+
+        cache_dir = str(pcm_cache.cache_dir) if pcm_cache is not None else None
+        self._dsp_proc = ctx.Process(
+            target=_dsp_worker_main,
+            args=(header_name, ring_name, ring_frames, self._dsp_commands, self._acks, cache_dir),
+            daemon=True,
+        )
+        self._out_proc = ctx.Process(
+            target=_output_worker_main,
+            args=(header_name, ring_name, ring_frames, self._out_commands, self._acks),
+            daemon=True,
+        )
+        self._dsp_proc.start()
+        self._out_proc.start()
+
+    def _call(self, name: str, *args):
+        self._dsp_commands.put(("call", name, args))
+
+    # ── параметры ───────────────────────────────────────────────────
+
+    @property
+    def underruns(self) -> int:
+        return int(self._ring.ints[UNDERRUNS]) if self._ring.ints is not None else 0
+
+    @underruns.setter
+    def underruns(self, value: int):
+        # базовый __init__ присваивает 0 до создания кольца
+        if getattr(self, "_ring", None) is not None:
+            self._ring.ints[UNDERRUNS] = int(value)
+
+    @property
+    def is_ab_original(self) -> bool:
+        return self._ab_original
+
+    @is_ab_original.setter
+    def is_ab_original(self, value: bool):
+        # UI выставляет флаг напрямую (новый раунд) — пробрасываем в DSP-процесс
+        self._ab_original = bool(value)
+        if getattr(self, "_dsp_commands", None) is not None:
+            self._call("set_ab_original", self._ab_original)
+
+    @property
+    def channels(self) -> int:
+        return self._meta_channels
+
+    @property
+    def has_audio(self) -> bool:
+        return self._loaded
+
+    @property
+    def alive(self) -> bool:
+        return self._dsp_proc.is_alive() and self._out_proc.is_alive()
+
+    @property
+    def dsp_errors(self) -> int:
+        return int(self._ring.ints[DSP_ERRORS]) if self._ring.ints is not None else 0
+
+    def set_volume(self, volume: float):
+        super().set_volume(volume)
+        self._ring.floats[VOLUME] = self._volume
+
+    def configure_output(self, block_size=None, device=KEEP_DEVICE, target_latency_ms=None):
+        super().configure_output(block_size, device, target_latency_ms)
+        # в процесс уходят уже итоговые значения: после pickle KEEP_DEVICE уже не тот же объект
+        self._call("configure_output", self.block_size, self.device, self.target_latency_ms)
+
+    def set_memory_mode(self, mode: str):
+        super().set_memory_mode(mode)
+        self._call("set_memory_mode", mode)
+
+    def set_loudness_match(self, enabled: bool, target_lufs=None):
+        super().set_loudness_match(enabled, target_lufs)
+        self._call("set_loudness_match", enabled, target_lufs)
+
+    def set_track_loudness(self, integrated_lufs, true_peak_db):
+        super().set_track_loudness(integrated_lufs, true_peak_db)
+        self._call("set_track_loudness", integrated_lufs, true_peak_db)
+
+    def set_filter_engine(self, engine: str):
+        if engine in FILTER_ENGINES:
+            self.filter_engine = engine
+            self._call("set_filter_engine", engine)
+
+    def memory_footprint(self) -> dict:
+        if self._meta_dtype is not None:
+            dtype = self._meta_dtype
+        elif self._meta_path is not None:
+            dtype = np.dtype(storage_dtype(self._meta_path, self.memory_mode))
+        else:
+            return {"mode": self.memory_mode, "dtype": None, "bytes": 0, "float32_bytes": 0}
+        size = self._meta_frames * self._meta_channels
+        return {
+            "mode": self.memory_mode,
+            "dtype": dtype.name,
+            "bytes": int(size * dtype.itemsize),
+            "float32_bytes": int(size * 4),
+        }
+
+    def eq_latency_ms(self) -> float:
+        if self._eq_coeffs is None or self.filter_engine != "fft-linear":
+            return 0.0
+        return (FIR_TAPS // 2) * 1000.0 / self._samplerate
+
+    # ── загрузка / EQ ───────────────────────────────────────────────
+
+    def load_file(self, path: str):
+        # метаданные читаем здесь (заодно проверяем, что файл открывается),
+        # декодирование — в DSP-процессе
+        with tracer.span("audio.load_file", cat="audio", process=True):
+            info = sf.info(path)
+        self._samplerate = int(info.samplerate)
+        self._meta_channels = min(int(info.channels), MAX_CHANNELS)
+        self._meta_frames = int(info.frames)
+        self._meta_path = path
+        self._meta_dtype = None
+        self._loaded = True
+        self._eq_coeffs = None
+        self._call("load_file", path)
+
+    def load_pack_track(self, pack_path: str, index: int):
+        # в DSP-процесс уходит только путь и номер — пак он откроет сам через mmap
+        with tracer.span("audio.load_pack_track", cat="audio", index=index, process=True):
+            pack = self.open_pack(pack_path)
+        track = pack.tracks[index]
+        self._samplerate = pack.samplerate
+        self._meta_channels = pack.channels
+        self._meta_frames = track.frames
+        self._meta_path = None
+        self._meta_dtype = pack.dtype
+        self._loaded = True
+        self._eq_coeffs = None
+        self._call("load_pack_track", pack_path, index)
+
+    def load_source(self, source: SignalSource):
+        self._samplerate = source.samplerate
+        self._meta_channels = min(source.channels, MAX_CHANNELS)
+        self._meta_frames = 0
+        self._meta_path = None
+        self._meta_dtype = None
+        self._loaded = True
+        self._eq_coeffs = None
+        self._call("load_source", source)
+
+    def set_peaking_eq(self, freq_hz: float, q: float, gain_db: float):
+        if not self.has_audio:
+            return
+        with tracer.span("audio.set_peaking_eq", cat="audio", engine=self.filter_engine, process=True):
+            self._eq_coeffs = peaking_eq_coeffs(self._samplerate, freq_hz, q, gain_db)
+            self._call("set_peaking_eq", freq_hz, q, gain_db)
+
+    def set_preview(self, freq_hz: float, gain_db: float):
+        # без очереди: DSP-процесс заберёт последнее значение раз в блок
+        self._ring.floats[PREVIEW_FREQ] = float(freq_hz)
+        self._ring.floats[PREVIEW_GAIN] = float(gain_db)
+        self._ring.ints[PREVIEW_SEQ] += 1
+
+    def clear_preview(self):
+        if self._ring.ints[PREVIEW_SEQ] > 0:
+            self.set_preview(float(self._ring.floats[PREVIEW_FREQ]), 0.0)
+
+    def toggle_ab(self):
+        self.is_ab_original = not self.is_ab_original
+
+    # ── воспроизведение ─────────────────────────────────────────────
+
+    def play(self):
+        if not self.has_audio or self.is_playing:
+            return
+        if not self.alive:
+            raise RuntimeError("audio processes are not running")
+
+        # оба процесса стоят (stop синхронный) — кольцо можно обнулить
+        self._ring.ints[WRITE_POS] = 0
+        self._ring.ints[READ_POS] = 0
+        self._ring.ints[CHANNELS] = self.channels
+        self._ring.ints[TARGET_FILL] = min(self._ring.ring_frames, 4 * self.block_size)
+
+        latency = self.target_latency_ms / 1000.0 if self.target_latency_ms > 0 else None
+        with tracer.span("audio.play_request", cat="audio", process=True):
+            self._dsp_commands.put(("play",))
+            self._out_commands.put(("open", self._samplerate, self.channels, self.block_size, self.device, latency))
+        self.is_playing = True
+
+        if tracer.enabled:
+            seq = int(self._ring.ints[SOUND_SEQ])
+            threading.Thread(target=self._watch_first_sound, args=(seq,), daemon=True).start()
+
+    def _watch_first_sound(self, seq: int, timeout: float = 5.0):
+        # процесс вывода отмечает первый блок в заголовке; переносим это в трейсер UI
+        deadline = time.perf_counter() + timeout
+        while self.is_playing and time.perf_counter() < deadline:
+            ints = self._ring.ints
+            if ints is None:
+                return
+            if int(ints[SOUND_SEQ]) != seq:
+                tracer.first_sound(at=float(self._ring.floats[FIRST_SOUND_T]))
+                return
+            time.sleep(0.001)
+
+    def stop(self):
+        if not self.is_playing:
+            return
+
+        if not self.alive:
+            # подтверждений ждать не от кого
+            self.is_playing = False
+            return
+
+        self._dsp_commands.put(("stop",))
+        self._out_commands.put(("close",))
+        # ждём подтверждения от обоих процессов
+        for _ in range(2):
+            try:
+                self._acks.get(timeout=1.0)
+            except queue.Empty:
+                break
+        self.is_playing = False
+
+    def close(self):
+        self.stop()
+        self._dsp_commands.put(("quit",))
+        self._out_commands.put(("quit",))
+        if tracer.enabled and self.alive:
+            self._collect_child_traces()
+        for proc in (self._dsp_proc, self._out_proc):
+            proc.join(timeout=2.0)
+            if proc.is_alive():
+                proc.terminate()
+        self._ring.close()
+
+
+    def _collect_child_traces(self):
+        # спаны дочерних процессов приходят при quit и вливаются в общий трейс
+        for _ in range(2):
+            try:
+                msg = self._acks.get(timeout=1.0)
+            except queue.Empty:
+                return
+            if isinstance(msg, tuple) and msg[0] == "trace":
+                tracer.merge(msg[2], process_name=msg[1])
+
+
+def create_audio_engine(mode: str, pcm_cache: Optional[PcmCache] = None) -> AudioEngine:
+    if mode == "process":
+        try:
+            return ProcessAudioEngine(pcm_cache=pcm_cache)
+        except Exception as e:
+            print(f"[WARN] process audio engine unavailable, using thread: {e}")
+    return AudioEngine(pcm_cache=pcm_cache)
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from math import pi, sin, cos, sqrt
+from typing import Optional
 import numpy as np
 
 
@@ -95,3 +96,206 @@ class BiquadState:
             self.y1[k], self.y2[k] = y1, y2
 
         return y
+
+
+# единичный фильтр. У peaking с gain 0 dB та же АЧХ (H = 1), но коэффициенты
+# другие (b1 == a1, b2 == a2), поэтому is_settled() их не считает равными
+FLAT_COEFFS = BiquadCoeffs(b0=1.0, b1=0.0, b2=0.0, a1=0.0, a2=0.0)
+
+
+class SmoothedBiquad(BiquadState):
+    """
+    Биквад, у которого коэффициенты можно менять каждый блок без щелчков:
+    при смене цели коэффициенты линейно интерполируются по отсчётам блока
+    от текущих к новым, состояние фильтра при этом не сбрасывается.
+    (Область устойчивости по (a1, a2) выпуклая, поэтому промежуточные
+    фильтры между двумя устойчивыми тоже устойчивы.)
+    """
+
+    def __init__(self, channels: int, initial: BiquadCoeffs = FLAT_COEFFS):
+        super().__init__(channels)
+        self.current = initial
+
+    def is_settled(self, target: BiquadCoeffs) -> bool:
+        return self.current == target
+
+    def process_block(self, x, c):
+        if self.current == c:
+            return super().process_block(x, c)
+
+        frames, ch = x.shape
+        y = np.empty_like(x)
+
+        start = self.current
+        t = np.arange(1, frames + 1, dtype=np.float64) / max(1, frames)
+        b0s = (start.b0 + (c.b0 - start.b0) * t).tolist()
+        b1s = (start.b1 + (c.b1 - start.b1) * t).tolist()
+        b2s = (start.b2 + (c.b2 - start.b2) * t).tolist()
+        a1s = (start.a1 + (c.a1 - start.a1) * t).tolist()
+        a2s = (start.a2 + (c.a2 - start.a2) * t).tolist()
+
+        for k in range(ch):
+            x1, x2 = self.x1[k], self.x2[k]
+            y1, y2 = self.y1[k], self.y2[k]
+
+            for n in range(frames):
+                xn = float(x[n, k])
+                yn = (
+                    b0s[n] * xn +
+                    b1s[n] * x1 +
+                    b2s[n] * x2 -
+                    a1s[n] * y1 -
+                    a2s[n] * y2
+                )
+                y[n, k] = yn
+                x2, x1 = x1, xn
+                y2, y1 = y1, yn
+
+            self.x1[k], self.x2[k] = x1, x2
+            self.y1[k], self.y2[k] = y1, y2
+
+        self.current = c
+        return y
+
+
+# ── FIR / FFT движок ────────────────────────────────────────────────
+#
+# Вся кривая EQ (любое число биквадов или целевая АЧХ) сворачивается
+# в один FIR, который применяется overlap-save свёрткой через numpy.fft.
+# Стоимость блока не зависит от числа полос.
+
+def biquad_response(c: BiquadCoeffs, n_fft: int) -> np.ndarray:
+    """Комплексная АЧХ биквада на сетке rfft (n_fft // 2 + 1 точек)."""
+    w = np.linspace(0.0, pi, n_fft // 2 + 1)
+    z1 = np.exp(-1j * w)
+    z2 = z1 * z1
+    return (c.b0 + c.b1 * z1 + c.b2 * z2) / (1.0 + c.a1 * z1 + c.a2 * z2)
+
+
+def _next_pow2(n: int) -> int:
+    return 1 << max(0, int(n - 1).bit_length())
+
+
+def _fir_from_response(h_full: np.ndarray, n_fft: int, n_taps: int, linear_phase: bool) -> np.ndarray:
+    if linear_phase:
+        # нулевая фаза -> симметричный импульс, центрируем и окном обрезаем до n_taps
+        h = np.fft.irfft(np.abs(h_full), n_fft)
+        center = n_taps // 2
+        h = np.roll(h, center)[:n_taps] * np.hanning(n_taps + 2)[1:-1]
+    else:
+        # минимально-фазовый (как у IIR) импульс, обрезанный с плавным хвостом
+        h = np.fft.irfft(h_full, n_fft)[:n_taps]
+        h = h * np.hanning(2 * n_taps + 1)[n_taps:-1]
+    return h.astype(np.float32)
+
+
+def design_fir(sections, n_taps: int = 2047, linear_phase: bool = False) -> np.ndarray:
+    """FIR из каскада BiquadCoeffs. Для linear_phase длина делается нечётной."""
+    n_taps = (int(n_taps) | 1) if linear_phase else int(n_taps)
+    n_fft = _next_pow2(n_taps * 4)
+
+    h_full = np.ones(n_fft // 2 + 1, dtype=np.complex128)
+    for c in sections:
+        h_full *= biquad_response(c, n_fft)
+
+    return _fir_from_response(h_full, n_fft, n_taps, linear_phase)
+
+
+def design_fir_from_magnitude(fs: float, freqs_hz, gains_db, n_taps: int = 2047) -> np.ndarray:
+    """Линейно-фазовый FIR по целевой АЧХ (точки freq/gain, интерполяция по log-частоте)."""
+    n_taps = int(n_taps) | 1
+    n_fft = _next_pow2(n_taps * 4)
+
+    grid = np.linspace(0.0, fs / 2.0, n_fft // 2 + 1)
+    log_f = np.log10(np.maximum(np.asarray(freqs_hz, dtype=np.float64), 1.0))
+    gains = np.interp(np.log10(np.maximum(grid, 1.0)), log_f, np.asarray(gains_db, dtype=np.float64))
+    mag = 10.0 ** (gains / 20.0)
+
+    return _fir_from_response(mag, n_fft, n_taps, linear_phase=True)
+
+
+def fir_latency_samples(fir: np.ndarray, linear_phase: bool) -> int:
+    return len(fir) // 2 if linear_phase else 0
+
+
+class OverlapSaveConvolver:
+    """
+    Блочная FFT-свёртка (overlap-save) для [frames, channels].
+
+    Буферы и спектр фильтра выделяются один раз; numpy.fft сам кэширует
+    планы для повторяющегося размера FFT.
+    """
+
+    def __init__(self, fir: np.ndarray, block_size: int, channels: int, latency_samples: int = 0):
+        self.block_size = int(block_size)
+        self.channels = int(channels)
+        self.latency_samples = int(latency_samples)
+
+        self._taps = len(fir)
+        self._hist = self._taps - 1
+        self.n_fft = _next_pow2(self.block_size + self._hist)
+
+        self._buf = np.zeros((self.n_fft, self.channels), dtype=np.float32)
+        self._spec = np.fft.rfft(np.asarray(fir, dtype=np.float64), self.n_fft)[:, None]
+
+    def set_fir(self, fir: np.ndarray, latency_samples: Optional[int] = None):
+        # та же длина — история сохраняется, без щелчка от обнуления
+        if len(fir) != self._taps:
+            raise ValueError("FIR length must not change")
+        self._spec = np.fft.rfft(np.asarray(fir, dtype=np.float64), self.n_fft)[:, None]
+        if latency_samples is not None:
+            self.latency_samples = int(latency_samples)
+
+    def reset(self):
+        self._buf.fill(0.0)
+
+    def latency_ms(self, fs: float) -> float:
+        return self.latency_samples * 1000.0 / fs
+
+    def process_block(self, x: np.ndarray) -> np.ndarray:
+        return self._split(x, self._process)
+
+    def bypass_block(self, x: np.ndarray) -> np.ndarray:
+        """
+        Вход, задержанный на latency_samples, без свёртки. История при этом
+        продолжает обновляться — обход (A/B) и обработка стыкуются без провала.
+        """
+        return self._split(x, self._bypass)
+
+    def _split(self, x: np.ndarray, fn) -> np.ndarray:
+        frames = x.shape[0]
+        if frames <= self.block_size:
+            return fn(x)
+
+        out = np.empty((frames, self.channels), dtype=np.float32)
+        for start in range(0, frames, self.block_size):
+            end = min(start + self.block_size, frames)
+            out[start:end] = fn(x[start:end])
+        return out
+
+    def _bypass(self, x: np.ndarray) -> np.ndarray:
+        n = x.shape[0]
+        hist = self._hist
+        buf = self._buf
+        start = hist - self.latency_samples
+
+        buf[hist:hist + n] = x
+        y = buf[start:start + n].copy()
+        buf[:hist] = buf[n:n + hist].copy()
+        return y
+
+    def _process(self, x: np.ndarray) -> np.ndarray:
+        n = x.shape[0]
+        hist = self._hist
+        buf = self._buf
+
+        buf[hist:hist + n] = x
+        buf[hist + n:] = 0.0
+
+        spec = np.fft.rfft(buf, axis=0)
+        spec *= self._spec
+        y = np.fft.irfft(spec, self.n_fft, axis=0)[hist:hist + n]
+
+        # последние taps-1 входных отсчётов — история для следующего блока
+        buf[:hist] = buf[n:n + hist].copy()
+        return y.astype(np.float32)
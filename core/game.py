@@ -2,6 +2,7 @@ import random
 from dataclasses import dataclass
 
 from core.scoring import Scoring, cents_error
+from core.tracing import tracer
 
 
 @dataclass
@@ -31,8 +32,9 @@ class Game:
         self.current_gain_db: float | None = None
 
     def new_round(self, gain_min_db: float = -15.0, gain_max_db: float = 15.0) -> tuple[float, float]:
-        self.current_freq = self._random_freq()
-        self.current_gain_db = random.choice([gain_min_db, gain_max_db])
+        with tracer.span("game.new_round", cat="game"):
+            self.current_freq = self._random_freq()
+            self.current_gain_db = random.choice([gain_min_db, gain_max_db])
         return self.current_freq, self.current_gain_db
 
     def _random_freq(self) -> float:
@@ -52,7 +54,8 @@ class Game:
 
         err_g = guessed_gain_db - true_g
 
-        score_info = self.scoring.register_result(err_cents=err_c, err_gain_db=err_g)
+        with tracer.span("game.submit_answer", cat="game"):
+            score_info = self.scoring.register_result(err_cents=err_c, err_gain_db=err_g)
 
         return GameRoundResult(
             true_freq=true_f,
@@ -0,0 +1,358 @@
+"""
+Офлайн-анализ громкости треков (ITU-R BS.1770): интегральная громкость
+LUFS с K-взвешиванием и гейтингом, true peak через 4x передискретизацию.
+
+Анализ считается один раз на файл в пуле процессов и кэшируется в JSON
+рядом с PCM-кэшем. Во время игры движок только умножает на готовые
+коэффициенты: выравнивание треков по громкости и компенсация EQ в A/B
+(изменение громкости от полосы EQ считается аналитически по её АЧХ).
+
+Пакетный анализ папки:  python -m core.loudness songs_story
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from math import pi, tan
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from core.filters import BiquadCoeffs, OverlapSaveConvolver, design_fir
+from core.utils import find_audio_files
+
+DEFAULT_CACHE_DIR = str(Path(__file__).resolve().parents[1] / "cache" / "loudness")
+ANALYSIS_VERSION = 1
+
+DEFAULT_TARGET_LUFS = -20.0
+TRUE_PEAK_CEILING_DB = -1.0
+SILENCE_LUFS = -70.0  # абсолютный гейт: тише этого громкость не определена
+
+K_WEIGHT_TAPS = 2047
+TP_OVERSAMPLE = 4
+TP_TAPS_PER_PHASE = 12
+READ_BLOCK_S = 2.0
+
+
+@dataclass
+class LoudnessInfo:
+    integrated_lufs: float
+    true_peak_db: float
+    samplerate: int
+
+
+# ── фильтры ────────────────────────────────────────────────────────
+
+def k_weighting_coeffs(fs: float) -> list[BiquadCoeffs]:
+    """Два биквада K-фильтра (полка + ФВЧ) для произвольной частоты дискретизации."""
+    # ступень 1: высокочастотная полка ~+4 dB (билинейная форма, совпадает
+    # с эталонными коэффициентами BS.1770 на 48 kHz)
+    g, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = tan(pi * fc / fs)
+    vh = 10.0 ** (g / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1.0 + k / q + k * k
+    shelf = BiquadCoeffs(
+        b0=(vh + vb * k / q + k * k) / a0,
+        b1=2.0 * (k * k - vh) / a0,
+        b2=(vh - vb * k / q + k * k) / a0,
+        a1=2.0 * (k * k - 1.0) / a0,
+        a2=(1.0 - k / q + k * k) / a0,
+    )
+
+    # ступень 2: ФВЧ ~38 Hz (числитель 1, -2, 1 как в BS.1770)
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = tan(pi * fc / fs)
+    a0 = 1.0 + k / q + k * k
+    highpass = BiquadCoeffs(b0=1.0, b1=-2.0, b2=1.0, a1=2.0 * (k * k - 1.0) / a0, a2=(1.0 - k / q + k * k) / a0)
+
+    return [shelf, highpass]
+
+
+def _power_response(sections, freqs_hz: np.ndarray, fs: float) -> np.ndarray:
+    """|H(f)|^2 каскада биквадов в заданных точках."""
+    z1 = np.exp(-1j * 2.0 * pi * np.asarray(freqs_hz, dtype=np.float64) / fs)
+    z2 = z1 * z1
+    p = np.ones(z1.shape, dtype=np.float64)
+    for c in sections:
+        h = (c.b0 + c.b1 * z1 + c.b2 * z2) / (1.0 + c.a1 * z1 + c.a2 * z2)
+        p *= np.abs(h) ** 2
+    return p
+
+
+def _true_peak_phases(n_phases: int = TP_OVERSAMPLE, taps: int = TP_TAPS_PER_PHASE) -> np.ndarray:
+    """Полифазная интерполяция: [phase, tap], ФНЧ с окном Ханна на исходном Найквисте."""
+    n = n_phases * taps
+    t = (np.arange(n) - (n - 1) / 2.0) / n_phases
+    h = np.sinc(t) * np.hanning(n + 2)[1:-1]
+    h = h.reshape(taps, n_phases).T
+    # каждая фаза — с единичным усилением на постоянке
+    return (h / h.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+# ── анализ ─────────────────────────────────────────────────────────
+
+def _channel_weights(channels: int) -> np.ndarray:
+    if channels == 6:
+        # 5.1: L R C LFE Ls Rs (LFE не учитывается)
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    return np.ones(channels)
+
+
+def integrated_loudness(hop_energy: np.ndarray, weights: np.ndarray) -> float:
+    """
+    Интегральная громкость из средних квадратов по 100 ms кускам [hops, channels].
+    Блоки 400 ms с перекрытием 75%, абсолютный гейт -70 LUFS, относительный -10 LU.
+    """
+    if hop_energy.shape[0] < 4:
+        return SILENCE_LUFS
+    per_hop = hop_energy @ weights
+    csum = np.concatenate([[0.0], np.cumsum(per_hop)])
+    blocks = (csum[4:] - csum[:-4]) / 4.0
+
+    with np.errstate(divide="ignore"):
+        lk = -0.691 + 10.0 * np.log10(blocks)
+    gated = blocks[lk > SILENCE_LUFS]
+    if gated.size == 0:
+        return SILENCE_LUFS
+
+    rel_gate = -0.691 + 10.0 * np.log10(gated.mean()) - 10.0
+    gated = blocks[(lk > SILENCE_LUFS) & (lk > rel_gate)]
+    return float(-0.691 + 10.0 * np.log10(gated.mean()))
+
+
+class LoudnessAnalyzer:
+    """Накопитель для офлайн-анализа: feed() блоками подряд, затем result()."""
+
+    def __init__(self, samplerate: int, channels: int, block_size: int = 8192):
+        self.samplerate = int(samplerate)
+        self.channels = int(channels)
+        self._hop = int(round(0.1 * samplerate))
+
+        # K-фильтр одним минимально-фазовым FIR, поблочно через FFT
+        kfir = design_fir(k_weighting_coeffs(samplerate), K_WEIGHT_TAPS)
+        self._kconv = OverlapSaveConvolver(kfir, block_size, channels)
+
+        self._phases = _true_peak_phases()
+        self._history = np.zeros((self._phases.shape[1] - 1, channels), dtype=np.float32)
+        self._peak = 0.0
+
+        self._hops = []
+        self._carry = np.zeros((0, channels), dtype=np.float64)
+
+    def feed(self, block: np.ndarray):
+        block = np.asarray(block, dtype=np.float32)
+        n = block.shape[0]
+        taps = self._phases.shape[1]
+
+        # true peak: все фазы интерполятора векторно, история тянется между блоками
+        ext = np.concatenate([self._history, block])
+        peak = max(self._peak, float(block.max()), -float(block.min())) if n else self._peak
+        for ph in self._phases:
+            y = np.zeros((n, self.channels), dtype=np.float32)
+            for k in range(taps):
+                y += ph[k] * ext[taps - 1 - k:taps - 1 - k + n]
+            if n:
+                peak = max(peak, float(y.max()), -float(y.min()))
+        self._peak = peak
+        self._history = ext[-(taps - 1):]
+
+        # энергия K-взвешенного сигнала по 100 ms кускам
+        hop = self._hop
+        kw = self._kconv.process_block(block).astype(np.float64)
+        sq = np.concatenate([self._carry, np.square(kw)])
+        full = sq.shape[0] // hop * hop
+        if full:
+            self._hops.append(sq[:full].reshape(-1, hop, self.channels).mean(axis=1))
+        self._carry = sq[full:]
+
+    def result(self) -> LoudnessInfo:
+        hop_energy = np.concatenate(self._hops) if self._hops else np.zeros((0, self.channels))
+        lufs = integrated_loudness(hop_energy, _channel_weights(self.channels))
+        return LoudnessInfo(
+            integrated_lufs=round(lufs, 2),
+            true_peak_db=round(float(20.0 * np.log10(max(self._peak, 1e-9))), 2),
+            samplerate=self.samplerate,
+        )
+
+
+def analyze_array(data: np.ndarray, samplerate: int) -> LoudnessInfo:
+    block_size = int(READ_BLOCK_S * samplerate)
+    meter = LoudnessAnalyzer(samplerate, data.shape[1], block_size)
+    for start in range(0, data.shape[0], block_size):
+        meter.feed(data[start:start + block_size])
+    return meter.result()
+
+
+def analyze_file(path: str) -> LoudnessInfo:
+    info = sf.info(path)
+    fs = int(info.samplerate)
+    block_size = int(READ_BLOCK_S * fs)
+    meter = LoudnessAnalyzer(fs, int(info.channels), block_size)
+    for block in sf.blocks(path, blocksize=block_size, always_2d=True, dtype="float32"):
+        meter.feed(block)
+    return meter.result()
+
+
+def eq_loudness_delta_db(sections, fs: float, bands_hz=None, spectrum_db=None) -> float:
+    """
+    Насколько EQ меняет K-взвешенную громкость, по АЧХ без обработки сигнала.
+
+    Спектр программы — по терцовому профилю трека (плотность мощности,
+    см. story_pack.band_spectrum_db), без него — розовый шум.
+    """
+    freqs = np.geomspace(20.0, min(20000.0, 0.49 * fs), 256)
+    if bands_hz is not None and spectrum_db is not None:
+        density = 10.0 ** (np.interp(np.log10(freqs), np.log10(bands_hz), spectrum_db) / 10.0)
+        weight = density * freqs  # сетка логарифмическая: df ~ f
+    else:
+        weight = np.ones_like(freqs)  # розовый шум: равная мощность на октаву
+
+    weight = weight * _power_response(k_weighting_coeffs(fs), freqs, fs)
+    eq = _power_response(sections, freqs, fs)
+    return float(10.0 * np.log10(np.sum(weight * eq) / np.sum(weight)))
+
+
+def track_gain_db(integrated_lufs: float, true_peak_db: float, target_lufs: float = DEFAULT_TARGET_LUFS) -> float:
+    """Усиление до целевой громкости, не выводящее true peak выше потолка."""
+    if integrated_lufs <= SILENCE_LUFS:
+        return 0.0
+    gain = target_lufs - integrated_lufs
+    return min(gain, TRUE_PEAK_CEILING_DB - true_peak_db)
+
+
+# ── кэш и пакетный анализ ──────────────────────────────────────────
+
+class LoudnessCache:
+    """JSON на файл; ключ — хэш пути, mtime и размера (как в PcmCache)."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, path: str) -> Path:
+        st = os.stat(path)
+        raw = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|v{ANALYSIS_VERSION}"
+        return self.cache_dir / f"{hashlib.sha1(raw.encode('utf-8')).hexdigest()}.json"
+
+    def lookup(self, path: str) -> Optional[LoudnessInfo]:
+        try:
+            data = json.loads(self._entry(path).read_text(encoding="utf-8"))
+            return LoudnessInfo(**data)
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def store(self, path: str, info: LoudnessInfo):
+        entry = self._entry(path)
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(asdict(info)), encoding="utf-8")
+        os.replace(tmp, entry)
+
+
+class LoudnessIndex:
+    """
+    Громкость треков для UI: кэш в памяти и на диске, промахи считаются
+    в фоне на пуле процессов (prefetch), get() никогда не ждёт анализа.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, workers: Optional[int] = None):
+        self._cache = LoudnessCache(cache_dir)
+        self._workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._known: dict[str, LoudnessInfo] = {}
+        self._pending: dict[str, Future] = {}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            workers = self._workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+            self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def prefetch(self, paths: list[str]):
+        for path in paths:
+            if path in self._known or path in self._pending:
+                continue
+            info = self._cache.lookup(path)
+            if info is not None:
+                self._known[path] = info
+            else:
+                self._pending[path] = self._get_pool().submit(analyze_file, path)
+
+    def get(self, path: str) -> Optional[LoudnessInfo]:
+        info = self._known.get(path)
+        if info is not None:
+            return info
+
+        fut = self._pending.get(path)
+        if fut is None:
+            self.prefetch([path])
+            return self._known.get(path)
+        if not fut.done():
+            return None
+
+        del self._pending[path]
+        try:
+            info = fut.result()
+        except Exception as e:
+            print(f"[WARN] loudness analysis failed for {path}: {e}")
+            return None
+        self._known[path] = info
+        try:
+            self._cache.store(path, info)
+        except OSError as e:
+            # кэш только для ускорения — результат остаётся в памяти
+            print(f"[WARN] loudness cache write failed for {path}: {e}")
+        return info
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._pending.clear()
+
+
+def analyze_files(paths: list[str], cache_dir: str = DEFAULT_CACHE_DIR, workers: Optional[int] = None) -> dict[str, LoudnessInfo]:
+    cache = LoudnessCache(cache_dir)
+    result = {}
+    misses = []
+    for path in paths:
+        info = cache.lookup(path)
+        if info is not None:
+            result[path] = info
+        else:
+            misses.append(path)
+
+    if misses:
+        workers = workers or max(1, min(len(misses), os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {path: pool.submit(analyze_file, path) for path in misses}
+            for path, fut in futures.items():
+                try:
+                    info = fut.result()
+                except Exception as e:
+                    print(f"[WARN] loudness analysis failed for {path}: {e}")
+                    continue
+                cache.store(path, info)
+                result[path] = info
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Freq Trainer loudness analysis")
+    parser.add_argument("folder")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    results = analyze_files(find_audio_files(args.folder), cache_dir=args.cache, workers=args.workers)
+    for path, info in sorted(results.items()):
+        print(f"{Path(path).name}: {info.integrated_lufs:+.1f} LUFS, true peak {info.true_peak_db:+.1f} dBTP")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+# кэш по умолчанию лежит рядом с app.py
+DEFAULT_CACHE_DIR = str(Path(__file__).resolve().parents[1] / "cache" / "pcm")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+STALE_TMP_S = 3600.0  # .tmp старше часа — остаток упавшей записи
+
+
+class PcmCache:
+    """
+    Дисковый кэш декодированного PCM.
+
+    Каждый трек хранится в отдельном .npy файле (формат [frames, channels]),
+    ключ — хэш от пути, mtime и размера исходника. При чтении файл
+    открывается через np.memmap, поэтому повторный запуск трека не требует
+    декодирования и не копирует данные в память.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_bytes)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, path: str, dtype: str = "float32") -> str:
+        st = os.stat(path)
+        raw = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{dtype}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, path: str, dtype: str = "float32") -> Optional[Tuple[np.ndarray, int]]:
+        key = self.key_for(path, dtype)
+        for entry in self.cache_dir.glob(f"{key}.*.npy"):
+            try:
+                sr = int(entry.name.split(".")[1])
+                data = np.load(entry, mmap_mode="r")
+            except (ValueError, OSError):
+                continue
+            # обновляем mtime — по нему работает LRU-очистка
+            try:
+                os.utime(entry)
+            except OSError:
+                pass
+            return data, sr
+        return None
+
+    def store(self, path: str, data: np.ndarray, samplerate: int, dtype: str = "float32") -> np.ndarray:
+        key = self.key_for(path, dtype)
+        target = self.cache_dir / f"{key}.{int(samplerate)}.npy"
+        tmp = self.cache_dir / f"{key}.{os.getpid()}.tmp"
+
+        # пишем во временный файл и атомарно переименовываем,
+        # чтобы параллельный читатель не увидел недописанный файл
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(data))
+            os.replace(tmp, target)
+        except OSError:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            raise
+
+        self.cleanup(keep=target)
+        return np.load(target, mmap_mode="r")
+
+    def load(self, path: str, dtype: str = "float32") -> Tuple[np.ndarray, int]:
+        hit = self.lookup(path, dtype)
+        if hit is not None:
+            return hit
+
+        data, sr = sf.read(path, always_2d=True, dtype=dtype)
+        try:
+            return self.store(path, data, int(sr), dtype), int(sr)
+        except OSError as e:
+            # кэш только для ускорения — отдаём уже декодированный массив
+            print(f"[WARN] pcm cache write failed for {path}: {e}")
+            self.cleanup()
+            return data, int(sr)
+
+    def total_bytes(self) -> int:
+        total = 0
+        for entry in self.cache_dir.glob("*.npy"):
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def cleanup(self, keep: Optional[Path] = None):
+        # недописанные .tmp от упавших процессов (свежие может писать соседний воркер)
+        now = time.time()
+        for entry in self.cache_dir.glob("*.tmp"):
+            try:
+                if now - entry.stat().st_mtime > STALE_TMP_S:
+                    entry.unlink()
+            except OSError:
+                pass
+
+        entries = []
+        for entry in self.cache_dir.glob("*.npy"):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+
+        # самые давно использованные — первыми на удаление
+        entries.sort(key=lambda e: e[0])
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and entry == keep:
+                continue
+            try:
+                entry.unlink()
+                total -= size
+            except OSError:
+                # на Windows файл может быть открыт как memmap — пропускаем
+                pass
+
+    def clear(self):
+        for entry in self.cache_dir.glob("*.npy"):
+            try:
+                entry.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,494 @@
+"""
+Headless-сервер рендеринга раундов для класса.
+
+Все места в классе подключаются к одному процессу: декодированные треки
+лежат в общем PcmCache (memmap, поэтому воркеры делят страницы через
+page cache), EQ считается на пуле процессов, готовые куски отдаются
+клиенту потоком.
+
+Протокол (TCP, строки JSON):
+    -> {"cmd": "new_round", "gain_abs": 15, "seconds": 8, "path": "eq"|"orig"}
+    <- {"type": "round", "track": ..., "samplerate": ..., "channels": ..., "frames": ...}
+    <- {"type": "chunk", "seq": i, "bytes": n}  + n байт float32 interleaved
+    <- {"type": "end"}
+    -> {"cmd": "answer", "freq": ..., "gain_db": ...}
+    <- {"type": "result", ...}
+    -> {"cmd": "stats"}
+    <- {"type": "stats", ...}
+
+На любой некорректный запрос (или сбой декодирования/рендера) приходит
+    <- {"type": "error", "error": ...}
+и сессия продолжается.
+
+Запуск:  python -m core.render_server --songs songs_story
+Нагрузочный тест:  python -m core.render_server --songs songs_story --bench 16
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from core.filters import BiquadCoeffs, BiquadState, peaking_eq_coeffs
+from core.game import Game
+from core.pcm_cache import DEFAULT_CACHE_DIR, PcmCache
+from core.sample_format import MEMORY_MODES, storage_dtype, to_float32
+from core.utils import find_audio_files
+
+log = logging.getLogger("render_server")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+SEGMENT_FRAMES = 16384  # размер куска, который рендерит один вызов воркера
+
+# ошибки самого файла — только из-за них трек убирается из ротации
+DECODE_ERRORS = (sf.SoundFileError, ValueError, FileNotFoundError)
+
+
+# ── воркер (отдельный процесс) ─────────────────────────────────────
+
+# открытые memmap'ы внутри процесса-воркера
+_worker_tracks: dict[str, tuple[np.ndarray, int]] = {}
+_worker_cache: Optional[PcmCache] = None
+
+
+def _worker_track(cache_dir: str, path: str, memory_mode: str) -> tuple[np.ndarray, int]:
+    global _worker_cache
+    if path not in _worker_tracks:
+        if _worker_cache is None:
+            _worker_cache = PcmCache(cache_dir)
+        _worker_tracks[path] = _worker_cache.load(path, dtype=storage_dtype(path, memory_mode))
+    return _worker_tracks[path]
+
+
+def _decode_track(cache_dir: str, path: str, memory_mode: str) -> tuple[int, int, int]:
+    data, sr = _worker_track(cache_dir, path, memory_mode)
+    return int(data.shape[0]), int(data.shape[1]), int(sr)
+
+
+def _render_segment(
+    cache_dir: str,
+    path: str,
+    memory_mode: str,
+    start: int,
+    frames: int,
+    coeffs: Optional[tuple],
+    state: Optional[tuple],
+) -> tuple[bytes, Optional[tuple]]:
+    data, _ = _worker_track(cache_dir, path, memory_mode)
+    chunk = np.ascontiguousarray(to_float32(data[start:start + frames]))
+
+    if coeffs is None:
+        return chunk.tobytes(), None
+
+    # состояние фильтра переносится между кусками, чтобы не было щелчков на стыках
+    st = BiquadState(chunk.shape[1])
+    if state is not None:
+        st.x1, st.x2, st.y1, st.y2 = (list(v) for v in state)
+    out = st.process_block(chunk, BiquadCoeffs(*coeffs))
+    return out.astype(np.float32).tobytes(), (st.x1, st.x2, st.y1, st.y2)
+
+
+# ── сервер ─────────────────────────────────────────────────────────
+
+@dataclass
+class SessionStats:
+    session_id: int
+    peer: str
+    rounds: int = 0
+    bytes_sent: int = 0
+    busy_s: float = 0.0
+    first_chunk_ms: list[float] = field(default_factory=list)
+    round_ms: list[float] = field(default_factory=list)
+
+    def report(self) -> dict:
+        def pct(values: list[float], p: float) -> float:
+            return round(float(np.percentile(values, p)), 2) if values else 0.0
+
+        return {
+            "session": self.session_id,
+            "peer": self.peer,
+            "rounds": self.rounds,
+            "bytes_sent": self.bytes_sent,
+            "first_chunk_ms_p50": pct(self.first_chunk_ms, 50),
+            "first_chunk_ms_p95": pct(self.first_chunk_ms, 95),
+            "round_ms_p50": pct(self.round_ms, 50),
+            "round_ms_p95": pct(self.round_ms, 95),
+            "throughput_mb_s": round(self.bytes_sent / self.busy_s / 1e6, 2) if self.busy_s > 0 else 0.0,
+        }
+
+
+@dataclass
+class TrackInfo:
+    path: str
+    frames: int
+    channels: int
+    samplerate: int
+
+
+class RenderServer:
+    def __init__(
+        self,
+        songs: list[str],
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        workers: Optional[int] = None,
+        memory_mode: str = "float32",
+    ):
+        self.songs = songs
+        self.cache_dir = cache_dir
+        self.memory_mode = memory_mode if memory_mode in MEMORY_MODES else "float32"
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # общий для всех сессий кэш метаданных декодированных треков
+        self._tracks: dict[str, TrackInfo] = {}
+        self._track_locks: dict[str, asyncio.Lock] = {}
+
+        self._session_ids = itertools.count(1)
+        self.sessions: dict[int, SessionStats] = {}
+        self.finished_sessions: list[SessionStats] = []
+
+    def _make_pool(self) -> ProcessPoolExecutor:
+        # spawn: при fork воркеры унаследовали бы сокеты клиентов и те не закрывались бы
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _restart_pool(self, broken: Optional[ProcessPoolExecutor]):
+        # упавший воркер ломает весь пул; пересоздаём один раз, даже если
+        # сбой увидели сразу несколько сессий
+        if broken is None or self._pool is not broken:
+            return
+        log.warning("worker pool broken, restarting")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._pool = self._make_pool()
+
+    async def start(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self._pool = self._make_pool()
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        addr = self._server.sockets[0].getsockname()
+        log.info("render server on %s:%s, %d songs, %d workers", addr[0], addr[1], len(self.songs), self.workers)
+        return addr
+
+    async def close(self, drain_timeout: float = 1.0):
+        # даём обработчикам увидеть EOF от уже отключившихся клиентов
+        deadline = time.perf_counter() + drain_timeout
+        while self.sessions and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    # ── треки ───────────────────────────────────────────────────────
+
+    async def _track(self, path: str) -> TrackInfo:
+        info = self._tracks.get(path)
+        if info is not None:
+            return info
+
+        # один трек декодируется один раз, даже если его запросили несколько сессий сразу
+        lock = self._track_locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            info = self._tracks.get(path)
+            if info is None:
+                loop = asyncio.get_running_loop()
+                frames, channels, sr = await loop.run_in_executor(
+                    self._pool, _decode_track, self.cache_dir, path, self.memory_mode
+                )
+                info = TrackInfo(path, frames, channels, sr)
+                self._tracks[path] = info
+        return info
+
+    # ── клиенты ─────────────────────────────────────────────────────
+
+    @staticmethod
+    def _number(msg: dict, key: str, default: float) -> float:
+        value = float(msg.get(key, default))
+        if not math.isfinite(value):
+            raise ValueError(f"{key} must be finite")
+        return value
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        stats = SessionStats(next(self._session_ids), str(peer))
+        self.sessions[stats.session_id] = stats
+        game = Game()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    await self._send(writer, {"type": "error", "error": "bad json"})
+                    continue
+                if not isinstance(msg, dict):
+                    await self._send(writer, {"type": "error", "error": "expected a JSON object"})
+                    continue
+
+                # кривые поля запроса — ответ с ошибкой, сессия продолжается
+                try:
+                    await self._dispatch(msg, game, stats, writer)
+                except (ValueError, TypeError) as e:
+                    await self._send(writer, {"type": "error", "error": f"bad request: {e}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions.pop(stats.session_id, None)
+            self.finished_sessions.append(stats)
+            log.info("session closed: %s", stats.report())
+            writer.close()
+
+    async def _dispatch(self, msg: dict, game: Game, stats: SessionStats, writer: asyncio.StreamWriter):
+        cmd = msg.get("cmd")
+        if cmd == "new_round":
+            await self._new_round(msg, game, stats, writer)
+        elif cmd == "answer":
+            freq = self._number(msg, "freq", 0.0)
+            gain_db = self._number(msg, "gain_db", 0.0)
+            result = game.submit_answer(freq, gain_db)
+            if result is None:
+                await self._send(writer, {"type": "error", "error": "no active round"})
+            else:
+                await self._send(writer, {"type": "result", **asdict(result)})
+        elif cmd == "stats":
+            await self._send(writer, {"type": "stats", **stats.report()})
+        else:
+            await self._send(writer, {"type": "error", "error": f"unknown cmd {cmd!r}"})
+
+    async def _send(self, writer: asyncio.StreamWriter, msg: dict, payload: bytes = b""):
+        writer.write(json.dumps(msg).encode("utf-8") + b"\n")
+        if payload:
+            writer.write(payload)
+        await writer.drain()
+
+    async def _new_round(self, msg: dict, game: Game, stats: SessionStats, writer: asyncio.StreamWriter):
+        if not self.songs:
+            await self._send(writer, {"type": "error", "error": "no songs"})
+            return
+
+        t0 = time.perf_counter()
+
+        gain_abs = self._number(msg, "gain_abs", 15.0)
+        seconds = self._number(msg, "seconds", 8.0)
+        if seconds <= 0.0:
+            raise ValueError("seconds must be positive")
+        if gain_abs < 0.0:
+            raise ValueError("gain_abs must not be negative")
+        apply_eq = msg.get("path", "eq") != "orig"
+
+        path = random.choice(self.songs)
+        pool = self._pool
+        try:
+            track = await self._track(path)
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+            await self._send(writer, {"type": "error", "error": "worker crashed, try again"})
+            return
+        except DECODE_ERRORS as e:
+            # битый файл убираем из ротации, клиенту — ошибка вместо обрыва
+            log.warning("cannot decode %s: %s", path, e)
+            if path in self.songs:
+                self.songs.remove(path)
+            await self._send(writer, {"type": "error", "error": f"cannot decode track {Path(path).name}"})
+            return
+        except Exception as e:
+            # сбой не из-за файла — трек остаётся в ротации
+            log.warning("cannot load %s: %s", path, e)
+            await self._send(writer, {"type": "error", "error": f"cannot load track {Path(path).name}"})
+            return
+
+        freq, gain_db = game.new_round(-gain_abs, gain_abs)
+        q = random.uniform(0.8, 2.0)
+
+        frames = min(track.frames, int(seconds * track.samplerate))
+        start = random.randint(0, max(0, track.frames - frames))
+
+        coeffs = None
+        if apply_eq:
+            c = peaking_eq_coeffs(track.samplerate, freq, q, gain_db)
+            coeffs = (c.b0, c.b1, c.b2, c.a1, c.a2)
+
+        await self._send(writer, {
+            "type": "round",
+            "track": Path(track.path).name,
+            "samplerate": track.samplerate,
+            "channels": track.channels,
+            "frames": frames,
+        })
+
+        loop = asyncio.get_running_loop()
+        state = None
+        seq = 0
+        pos = start
+        end = start + frames
+        while pos < end:
+            n = min(SEGMENT_FRAMES, end - pos)
+            pool = self._pool
+            try:
+                payload, state = await loop.run_in_executor(
+                    pool, _render_segment, self.cache_dir, track.path, self.memory_mode, pos, n, coeffs, state
+                )
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._restart_pool(pool)
+                log.warning("render failed for %s: %s", track.path, e)
+                await self._send(writer, {"type": "error", "error": f"render failed: {e}"})
+                return
+            if seq == 0:
+                stats.first_chunk_ms.append((time.perf_counter() - t0) * 1000.0)
+            await self._send(writer, {"type": "chunk", "seq": seq, "bytes": len(payload)}, payload)
+            stats.bytes_sent += len(payload)
+            seq += 1
+            pos += n
+
+        await self._send(writer, {"type": "end"})
+
+        dt = time.perf_counter() - t0
+        stats.rounds += 1
+        stats.busy_s += dt
+        stats.round_ms.append(dt * 1000.0)
+
+
+# ── клиент / нагрузочный тест ──────────────────────────────────────
+
+class RenderClient:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> "RenderClient":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, msg: dict) -> dict:
+        self.writer.write(json.dumps(msg).encode("utf-8") + b"\n")
+        await self.writer.drain()
+        return await self._read_msg()
+
+    async def _read_msg(self) -> dict:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("server closed connection")
+        return json.loads(line)
+
+    async def new_round(self, **params) -> tuple[dict, np.ndarray]:
+        header = await self.request({"cmd": "new_round", **params})
+        if header.get("type") != "round":
+            raise RuntimeError(header.get("error", "unexpected reply"))
+
+        parts = []
+        while True:
+            msg = await self._read_msg()
+            if msg["type"] == "end":
+                break
+            if msg["type"] == "error":
+                raise RuntimeError(msg.get("error", "render failed"))
+            parts.append(await self.reader.readexactly(msg["bytes"]))
+
+        audio = np.frombuffer(b"".join(parts), dtype=np.float32)
+        return header, audio.reshape(-1, header["channels"])
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def run_load_test(host: str, port: int, sessions: int, rounds: int, seconds: float) -> list[dict]:
+    async def one_session() -> dict:
+        client = await RenderClient.connect(host, port)
+        errors = 0
+        try:
+            for _ in range(rounds):
+                # ответ-ошибка сервера не обрывает прогон, а считается
+                try:
+                    await client.new_round(seconds=seconds)
+                except RuntimeError:
+                    errors += 1
+                    continue
+                reply = await client.request({"cmd": "answer", "freq": 1000.0, "gain_db": 0.0})
+                if reply.get("type") == "error":
+                    errors += 1
+            report = await client.request({"cmd": "stats"})
+            report["errors"] = errors
+            return report
+        finally:
+            await client.close()
+
+    return await asyncio.gather(*(one_session() for _ in range(sessions)))
+
+
+async def _main_async(args):
+    songs = find_audio_files(args.songs)
+    server = RenderServer(songs, cache_dir=args.cache, workers=args.workers, memory_mode=args.memory_mode)
+    await server.start(args.host, args.port)
+
+    if not args.bench:
+        await server.serve_forever()
+        return
+
+    try:
+        t0 = time.perf_counter()
+        reports = await run_load_test(args.host, args.port, args.bench, args.rounds, args.seconds)
+        wall = time.perf_counter() - t0
+    finally:
+        await server.close()
+
+    for r in reports:
+        print(json.dumps(r))
+    total = sum(r["bytes_sent"] for r in reports)
+    errors = sum(r["errors"] for r in reports)
+    print(
+        f"{args.bench} sessions x {args.rounds} rounds in {wall:.2f} s, "
+        f"{total / wall / 1e6:.2f} MB/s total, {errors} errors"
+    )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Freq Trainer render server")
+    parser.add_argument("--songs", required=True, help="папка с треками")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR, help="папка PCM-кэша")
+    parser.add_argument("--memory-mode", choices=MEMORY_MODES, default="float32", help="формат хранения PCM")
+    parser.add_argument("--bench", type=int, default=0, help="запустить N клиентов на localhost и выйти")
+    parser.add_argument("--rounds", type=int, default=3, help="раундов на клиента в --bench")
+    parser.add_argument("--seconds", type=float, default=8.0, help="длина отрывка в --bench")
+    args = parser.parse_args()
+
+    asyncio.run(_main_async(args))
+
+
+if __name__ == "__main__":
+    main()
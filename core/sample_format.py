@@ -0,0 +1,55 @@
+import numpy as np
+import soundfile as sf
+
+# подтипы soundfile -> минимальный целочисленный dtype без потери точности
+_INT16_SUBTYPES = {"PCM_S8", "PCM_U8", "PCM_16"}
+_INT32_SUBTYPES = {"PCM_24", "PCM_32"}
+
+_SCALE = {
+    "int16": 1.0 / 32768.0,
+    "int32": 1.0 / 2147483648.0,
+}
+
+MEMORY_MODES = ("float32", "compact")
+
+
+def native_dtype(path: str) -> str:
+    """
+    dtype, в котором трек хранится без потерь.
+    Для сжатых форматов (mp3/ogg) декодер всё равно выдаёт float — оставляем float32.
+    """
+    try:
+        subtype = sf.info(path).subtype
+    except Exception:
+        return "float32"
+    if subtype in _INT16_SUBTYPES:
+        return "int16"
+    if subtype in _INT32_SUBTYPES:
+        return "int32"
+    return "float32"
+
+
+def storage_dtype(path: str, memory_mode: str) -> str:
+    if memory_mode == "compact":
+        return native_dtype(path)
+    return "float32"
+
+
+def to_float32_into(block: np.ndarray, out: np.ndarray):
+    """То же, что to_float32, но сразу в готовый буфер (без промежуточной копии)."""
+    scale = _SCALE.get(block.dtype.name)
+    if scale is None:
+        out[...] = block
+    else:
+        np.multiply(block, scale, out=out, casting="unsafe")
+
+
+def to_float32(block: np.ndarray) -> np.ndarray:
+    """Переводит блок в float32 [-1, 1); float32 возвращается как есть, без копии."""
+    if block.dtype == np.float32:
+        return block
+    scale = _SCALE.get(block.dtype.name)
+    out = block.astype(np.float32)
+    if scale is not None:
+        np.multiply(out, scale, out=out)
+    return out
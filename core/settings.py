@@ -0,0 +1,47 @@
+import json
+from pathlib import Path
+
+PRESETS_PATH = str(Path(__file__).resolve().parents[1] / "data" / "presets.json")
+
+DEFAULT_AUDIO_SETTINGS = {
+    "block_size": 1024,
+    "target_latency_ms": 0.0,  # 0 = по умолчанию для устройства
+    "device": None,            # имя устройства вывода; None = системное
+    "safety_margin": 0.5,      # запас по времени DSP для автокалибровки
+    "memory_mode": "float32",  # "float32" | "compact" (исходная разрядность)
+    "filter_engine": "iir",    # "iir" | "fft" | "fft-linear"
+    "engine_mode": "thread",   # "thread" | "process" (DSP и вывод в отдельных процессах)
+    "loudness_match": True,    # выравнивать треки и A/B по громкости (BS.1770)
+    "target_lufs": -20.0,
+}
+
+
+def load_settings(path: str = PRESETS_PATH) -> dict:
+    """Читает настройки из presets.json; при ошибке возвращает пустой словарь."""
+    p = Path(path)
+    if not p.is_file():
+        return {}
+    try:
+        text = p.read_text(encoding="utf-8").strip()
+        if not text:
+            return {}
+        data = json.loads(text)
+    except (OSError, ValueError) as e:
+        print(f"Не удалось прочитать настройки {path}: {e}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_settings(settings: dict, path: str = PRESETS_PATH):
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(settings, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(p)
+
+
+def audio_settings(settings: dict) -> dict:
+    """Секция "audio" с подставленными значениями по умолчанию."""
+    merged = dict(DEFAULT_AUDIO_SETTINGS)
+    merged.update(settings.get("audio") or {})
+    return merged
@@ -0,0 +1,136 @@
+from math import log, pi
+from typing import Optional
+
+import numpy as np
+
+
+class SignalSource:
+    """
+    Генерируемый на лету тестовый сигнал.
+
+    Отдаёт блоки [frames, channels] float32 через read(); ничего не читает
+    с диска и не держит буфер на всю длину. Шум строится от seed, поэтому
+    при тех же размерах блоков сигнал воспроизводится один в один.
+    """
+
+    kind = "signal"
+
+    def __init__(self, samplerate: int = 44100, channels: int = 2, seed: int = 0, level_db: float = -18.0):
+        self.samplerate = int(samplerate)
+        self.channels = int(channels)
+        self.seed = int(seed)
+        self.level_db = float(level_db)
+        self._amp = 10.0 ** (self.level_db / 20.0)  # RMS-уровень
+        self.reset()
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind} ({self.level_db:+.0f} dBFS)"
+
+    def reset(self):
+        self._pos = 0
+        self._rng = np.random.default_rng(self.seed)
+
+    def read(self, frames: int) -> np.ndarray:
+        out = self._generate(self._pos, int(frames))
+        self._pos += int(frames)
+        return out.astype(np.float32, copy=False)
+
+    def _generate(self, pos: int, frames: int) -> np.ndarray:
+        raise NotImplementedError
+
+
+class WhiteNoise(SignalSource):
+    kind = "white"
+
+    def _generate(self, pos: int, frames: int) -> np.ndarray:
+        return self._rng.standard_normal((frames, self.channels)) * self._amp
+
+
+class PinkNoise(SignalSource):
+    """Розовый шум по Voss-McCartney: строка k обновляется раз в 2**k отсчётов."""
+
+    kind = "pink"
+    ROWS = 16
+
+    def reset(self):
+        super().reset()
+        self._rows = np.zeros((self.ROWS, self.channels))
+
+    def _generate(self, pos: int, frames: int) -> np.ndarray:
+        idx = np.arange(pos, pos + frames, dtype=np.int64)
+        out = np.zeros((frames, self.channels))
+
+        for k in range(self.ROWS):
+            seg = idx >> k
+            first = int(seg[0])
+            values = self._rng.standard_normal((int(seg[-1]) - first + 1, self.channels))
+            # первый сегмент начался ещё в прошлом блоке — продолжаем его значение
+            if pos & ((1 << k) - 1):
+                values[0] = self._rows[k]
+            self._rows[k] = values[-1]
+            out += values[seg - first]
+
+        out *= self._amp / np.sqrt(self.ROWS)
+        return out
+
+
+class Multitone(SignalSource):
+    kind = "multitone"
+
+    def __init__(self, samplerate: int = 44100, channels: int = 2, seed: int = 0, level_db: float = -18.0,
+                 freqs: Optional[list[float]] = None):
+        # по умолчанию — терцовые частоты 31.5 Гц … 16 кГц
+        self.freqs = np.asarray(freqs if freqs is not None else 1000.0 * 2.0 ** (np.arange(-15, 13) / 3.0))
+        super().__init__(samplerate, channels, seed, level_db)
+
+    def reset(self):
+        super().reset()
+        self.freqs = self.freqs[self.freqs < self.samplerate / 2]
+        # случайные фазы — чтобы пик-фактор не рос как у синфазной суммы
+        self._phases = self._rng.uniform(0.0, 2.0 * pi, len(self.freqs))
+        self._tone_amp = self._amp * np.sqrt(2.0 / max(1, len(self.freqs)))
+
+    def _generate(self, pos: int, frames: int) -> np.ndarray:
+        t = (pos + np.arange(frames)) / self.samplerate
+        mono = np.sin(np.outer(t, 2.0 * pi * self.freqs) + self._phases).sum(axis=1) * self._tone_amp
+        return np.repeat(mono[:, None], self.channels, axis=1)
+
+
+class LogSweep(SignalSource):
+    """Экспоненциальный свип f1 -> f2 за duration секунд, по кругу."""
+
+    kind = "sweep"
+    FADE_S = 0.005
+
+    def __init__(self, samplerate: int = 44100, channels: int = 2, seed: int = 0, level_db: float = -18.0,
+                 f1: float = 20.0, f2: float = 20000.0, duration: float = 10.0):
+        self.f1 = float(f1)
+        self.f2 = float(min(f2, samplerate * 0.499))
+        self.duration = float(duration)
+        super().__init__(samplerate, channels, seed, level_db)
+
+    def _generate(self, pos: int, frames: int) -> np.ndarray:
+        t = ((pos + np.arange(frames)) / self.samplerate) % self.duration
+        k = log(self.f2 / self.f1)
+        phase = 2.0 * pi * self.f1 * self.duration / k * np.expm1(t * k / self.duration)
+
+        # короткие фейды на стыке периодов, иначе щелчок при возврате к f1
+        fade = np.minimum(1.0, np.minimum(t, self.duration - t) / self.FADE_S)
+        mono = np.sin(phase) * fade * (self._amp * np.sqrt(2.0))
+        return np.repeat(mono[:, None], self.channels, axis=1)
+
+
+SIGNAL_KINDS = {
+    "pink": PinkNoise,
+    "white": WhiteNoise,
+    "multitone": Multitone,
+    "sweep": LogSweep,
+}
+
+
+def create_signal(kind: str, samplerate: int = 44100, channels: int = 2, seed: int = 0) -> SignalSource:
+    cls = SIGNAL_KINDS.get(kind)
+    if cls is None:
+        raise ValueError(f"unknown signal kind: {kind}")
+    return cls(samplerate=samplerate, channels=channels, seed=seed)
@@ -0,0 +1,279 @@
+"""
+Пак сюжетного режима: один файл с готовыми к игре отрывками.
+
+Сборка (один раз, после изменения songs_story):
+    python -m core.story_pack build songs_story songs_story.pack
+
+Формат:
+    8 байт   magic b"FTSPACK1"
+    8 байт   длина JSON-заголовка (little-endian uint64)
+    JSON     заголовок: samplerate, channels, dtype, data_offset и список
+             треков (offset, frames, уровни, терцовый спектр)
+    ...      выравнивание до PAGE
+    данные   int16 interleaved [frames, channels], трек за треком
+
+Story mode открывает пак через np.memmap и отдаёт в AudioEngine готовые
+срезы — в раунде нет ни декодирования, ни ресэмплинга.
+"""
+import argparse
+import json
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from core.loudness import analyze_array
+from core.utils import find_audio_files
+
+MAGIC = b"FTSPACK1"
+VERSION = 1
+PAGE = 4096
+ALIGN = 64
+
+DEFAULT_SAMPLERATE = 44100
+DEFAULT_EXCERPT_S = 30.0
+FADE_S = 0.01
+
+# терцовые полосы 20 Гц … 20 кГц
+BAND_CENTERS_HZ = [round(1000.0 * 2.0 ** (k / 3.0), 1) for k in range(-17, 14)]
+
+
+@dataclass
+class PackTrack:
+    name: str
+    offset: int
+    frames: int
+    source_samplerate: int
+    start_s: float
+    rms_db: float
+    peak_db: float
+    spectrum_db: list[float]
+    # громкость отрывка (BS.1770) — для выравнивания без анализа в игре
+    integrated_lufs: Optional[float] = None
+    true_peak_db: Optional[float] = None
+
+
+# ── анализ / подготовка ────────────────────────────────────────────
+
+def _to_stereo(x: np.ndarray, channels: int) -> np.ndarray:
+    if x.shape[1] == channels:
+        return x
+    if x.shape[1] == 1:
+        return np.repeat(x, channels, axis=1)
+    return x[:, :channels]
+
+
+def _resample_fft(x: np.ndarray, sr_in: int, sr_out: int) -> np.ndarray:
+    if sr_in == sr_out:
+        return x
+    n_in = x.shape[0]
+    n_out = int(round(n_in * sr_out / sr_in))
+    spec = np.fft.rfft(x, axis=0)
+    bins = n_out // 2 + 1
+    if bins <= spec.shape[0]:
+        spec = spec[:bins]
+    else:
+        spec = np.concatenate([spec, np.zeros((bins - spec.shape[0], x.shape[1]), dtype=spec.dtype)])
+    return np.fft.irfft(spec, n_out, axis=0) * (n_out / n_in)
+
+
+def _loudest_window(x: np.ndarray, sr: int, seconds: float) -> int:
+    """Начало самого громкого окна длиной seconds (по энергии в секундных кусках)."""
+    win = int(seconds * sr)
+    if x.shape[0] <= win:
+        return 0
+    hop = sr // 2
+    n_hops = x.shape[0] // hop
+    energy = np.square(x[: n_hops * hop]).reshape(n_hops, hop, -1).sum(axis=(1, 2))
+    per_win = max(1, win // hop)
+    sums = np.convolve(energy, np.ones(per_win), mode="valid")
+    return int(np.argmax(sums)) * hop
+
+
+def band_spectrum_db(x: np.ndarray, sr: int, n_fft: int = 8192) -> list[float]:
+    """Средняя мощность в терцовых полосах (дБ), моно-сумма, кадры по n_fft."""
+    mono = x.mean(axis=1)
+    n_frames = max(1, mono.shape[0] // n_fft)
+    frames = np.resize(mono, n_frames * n_fft).reshape(n_frames, n_fft) * np.hanning(n_fft)
+    power = np.mean(np.abs(np.fft.rfft(frames, axis=1)) ** 2, axis=0)
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sr)
+
+    out = []
+    for fc in BAND_CENTERS_HZ:
+        lo, hi = fc * 2.0 ** (-1 / 6), fc * 2.0 ** (1 / 6)
+        sel = (freqs >= lo) & (freqs < hi)
+        p = float(power[sel].mean()) if sel.any() else 0.0
+        out.append(round(10.0 * np.log10(max(p, 1e-20)), 2))
+    return out
+
+
+def prepare_excerpt(path: str, samplerate: int, channels: int, seconds: float) -> tuple[np.ndarray, dict]:
+    data, sr = sf.read(path, always_2d=True, dtype="float32")
+    data = _to_stereo(data, channels)
+
+    start = _loudest_window(data, int(sr), seconds)
+    excerpt = data[start:start + int(seconds * sr)].astype(np.float64)
+    excerpt = _resample_fft(excerpt, int(sr), samplerate)
+
+    # короткие фейды — отрывок играет по кругу
+    fade = min(int(FADE_S * samplerate), excerpt.shape[0] // 2)
+    if fade > 0:
+        ramp = np.linspace(0.0, 1.0, fade)[:, None]
+        excerpt[:fade] *= ramp
+        excerpt[-fade:] *= ramp[::-1]
+
+    excerpt = np.clip(excerpt, -1.0, 32767.0 / 32768.0)
+    loudness = analyze_array(excerpt.astype(np.float32), samplerate)
+    rms = float(np.sqrt(np.mean(np.square(excerpt)))) if excerpt.size else 0.0
+    peak = float(np.max(np.abs(excerpt))) if excerpt.size else 0.0
+
+    meta = {
+        "name": Path(path).name,
+        "source_samplerate": int(sr),
+        "start_s": round(start / sr, 3),
+        "rms_db": round(20.0 * np.log10(max(rms, 1e-9)), 2),
+        "peak_db": round(20.0 * np.log10(max(peak, 1e-9)), 2),
+        "spectrum_db": band_spectrum_db(excerpt, samplerate),
+        "integrated_lufs": loudness.integrated_lufs,
+        "true_peak_db": loudness.true_peak_db,
+    }
+    return (excerpt * 32768.0).round().astype(np.int16), meta
+
+
+# ── сборка / чтение ────────────────────────────────────────────────
+
+def _align(n: int, a: int) -> int:
+    return (n + a - 1) // a * a
+
+
+def build_story_pack(
+    folder: str,
+    out_path: str,
+    samplerate: int = DEFAULT_SAMPLERATE,
+    channels: int = 2,
+    seconds: float = DEFAULT_EXCERPT_S,
+) -> int:
+    files = find_audio_files(folder)
+    excerpts = []
+    tracks = []
+    offset = 0
+    for path in files:
+        try:
+            pcm, meta = prepare_excerpt(path, samplerate, channels, seconds)
+        except Exception as e:
+            print(f"Пропускаю {path}: {e}")
+            continue
+        meta["offset"] = offset
+        meta["frames"] = int(pcm.shape[0])
+        offset = _align(offset + pcm.nbytes, ALIGN)
+        excerpts.append(pcm)
+        tracks.append(meta)
+
+    header = {
+        "version": VERSION,
+        "samplerate": samplerate,
+        "channels": channels,
+        "dtype": "int16",
+        "bands_hz": BAND_CENTERS_HZ,
+        "tracks": tracks,
+    }
+    # data_offset зависит от длины заголовка — считаем с запасом под само число
+    header["data_offset"] = 0
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_offset = _align(len(MAGIC) + 8 + len(raw) + 32, PAGE)
+    header["data_offset"] = data_offset
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    tmp = Path(out_path).with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(raw)))
+        f.write(raw)
+        for pcm, meta in zip(excerpts, tracks):
+            f.seek(data_offset + meta["offset"])
+            f.write(pcm.tobytes())
+    tmp.replace(out_path)
+    return len(tracks)
+
+
+class StoryPack:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not a story pack")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+
+        if header.get("version") != VERSION:
+            raise ValueError(f"{path}: unsupported pack version {header.get('version')}")
+
+        self.samplerate = int(header["samplerate"])
+        self.channels = int(header["channels"])
+        self.dtype = np.dtype(header["dtype"])
+        self.bands_hz = header.get("bands_hz", [])
+        self.tracks = [
+            PackTrack(
+                name=t["name"],
+                offset=int(t["offset"]),
+                frames=int(t["frames"]),
+                source_samplerate=int(t["source_samplerate"]),
+                start_s=float(t["start_s"]),
+                rms_db=float(t["rms_db"]),
+                peak_db=float(t["peak_db"]),
+                spectrum_db=list(t["spectrum_db"]),
+                integrated_lufs=t.get("integrated_lufs"),
+                true_peak_db=t.get("true_peak_db"),
+            )
+            for t in header["tracks"]
+        ]
+
+        self._data: Optional[np.memmap] = None
+        if self.tracks:
+            last = self.tracks[-1]
+            size = last.offset + last.frames * self.channels * self.dtype.itemsize
+            self._data = np.memmap(path, dtype=np.uint8, mode="r", offset=int(header["data_offset"]), shape=(size,))
+
+    def __len__(self) -> int:
+        return len(self.tracks)
+
+    def audio(self, index: int) -> np.ndarray:
+        """Трек как [frames, channels] без копирования (view на memmap)."""
+        t = self.tracks[index]
+        nbytes = t.frames * self.channels * self.dtype.itemsize
+        raw = self._data[t.offset:t.offset + nbytes]
+        return raw.view(self.dtype).reshape(t.frames, self.channels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Freq Trainer story pack")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="собрать пак из папки с треками")
+    b.add_argument("folder")
+    b.add_argument("out")
+    b.add_argument("--samplerate", type=int, default=DEFAULT_SAMPLERATE)
+    b.add_argument("--seconds", type=float, default=DEFAULT_EXCERPT_S)
+
+    i = sub.add_parser("info", help="показать содержимое пака")
+    i.add_argument("pack")
+
+    args = parser.parse_args()
+    if args.cmd == "build":
+        n = build_story_pack(args.folder, args.out, samplerate=args.samplerate, seconds=args.seconds)
+        print(f"Собрано треков: {n} -> {args.out}")
+    else:
+        pack = StoryPack(args.pack)
+        print(f"{args.pack}: {len(pack)} tracks, {pack.samplerate} Hz, {pack.channels} ch, {pack.dtype}")
+        for t in pack.tracks:
+            line = f"  {t.name}: {t.frames / pack.samplerate:.1f} s, rms {t.rms_db:+.1f} dB, peak {t.peak_db:+.1f} dB"
+            if t.integrated_lufs is not None:
+                line += f", {t.integrated_lufs:+.1f} LUFS, true peak {t.true_peak_db:+.1f} dBTP"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Лёгкая трассировка жизненного цикла раунда.
+
+Спаны пишутся в формате Chrome trace events (ph "X"), файл открывается
+в chrome://tracing или ui.perfetto.dev. Включается переменной окружения
+FREQ_TRAINER_TRACE=1; выключенный трейсер стоит один if на вызов.
+
+Метрики (скользящие перцентили):
+  time_to_first_sound — New Round -> раунд готов, плюс Play -> первый блок
+                        ушёл в устройство (время раздумий между ними не считаем);
+                        только первый Play раунда;
+  play_to_sound       — Play -> первый блок для повторных Play в том же раунде;
+  answer_to_next_round — ответ -> следующий раунд готов.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Optional
+
+TRACE_ENV = "FREQ_TRAINER_TRACE"
+DEFAULT_REPORT_DIR = str(Path(__file__).resolve().parents[1] / "reports")
+
+_NULL_SPAN = nullcontext()
+
+
+def trace_enabled_from_env() -> bool:
+    return os.environ.get(TRACE_ENV, "").strip().lower() not in ("", "0", "off", "false", "no")
+
+
+def _percentiles(values, ps=(50, 90, 99)) -> dict:
+    data = sorted(values)
+    if not data:
+        return {"n": 0}
+    out = {"n": len(data)}
+    for p in ps:
+        k = min(len(data) - 1, int(round(p / 100.0 * (len(data) - 1))))
+        out[f"p{p}"] = round(data[k], 2)
+    return out
+
+
+class Tracer:
+    def __init__(self, enabled: bool = False, max_events: int = 200_000, window: int = 200):
+        self.enabled = enabled
+        self._t0 = time.perf_counter()
+        self._pid = os.getpid()
+        self._events: deque = deque(maxlen=max_events)
+        self._thread_names: dict[int, str] = {}
+        self._foreign_meta: list[dict] = []  # имена процессов/потоков из merge()
+
+        self.round_id = 0
+        self._round_start: Optional[float] = None
+        self._round_ready_s: Optional[float] = None
+        self._play_start: Optional[float] = None
+        self._answer_time: Optional[float] = None
+
+        self.time_to_first_sound_ms: deque = deque(maxlen=window)
+        self.play_to_sound_ms: deque = deque(maxlen=window)
+        self.answer_to_next_round_ms: deque = deque(maxlen=window)
+
+    def _ts(self, t: float) -> float:
+        return (t - self._t0) * 1e6
+
+    def _tid(self) -> int:
+        th = threading.current_thread()
+        tid = th.ident or 0
+        if tid not in self._thread_names:
+            self._thread_names[tid] = th.name
+        return tid
+
+    # ── спаны ───────────────────────────────────────────────────────
+
+    def span(self, name: str, cat: str = "round", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, cat, args)
+
+    @contextmanager
+    def _span(self, name: str, cat: str, args: dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            args.setdefault("round", self.round_id)
+            self._events.append({
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": self._ts(start),
+                "dur": (end - start) * 1e6,
+                "pid": self._pid,
+                "tid": self._tid(),
+                "args": args,
+            })
+
+    def instant(self, name: str, cat: str = "round", **args):
+        if not self.enabled:
+            return
+        args.setdefault("round", self.round_id)
+        self._events.append({
+            "name": name,
+            "cat": cat,
+            "ph": "i",
+            "s": "p",
+            "ts": self._ts(time.perf_counter()),
+            "pid": self._pid,
+            "tid": self._tid(),
+            "args": args,
+        })
+
+    # ── этапы раунда ────────────────────────────────────────────────
+
+    def begin_round(self):
+        if not self.enabled:
+            return
+        self.round_id += 1
+        self._round_start = time.perf_counter()
+        self._round_ready_s = None
+        self._play_start = None
+        self.instant("new_round_clicked")
+
+    def round_ready(self):
+        if not self.enabled or self._round_start is None:
+            return
+        now = time.perf_counter()
+        self._round_ready_s = now - self._round_start
+        self.instant("round_ready", ms=round(self._round_ready_s * 1000.0, 2))
+
+        if self._answer_time is not None:
+            self.answer_to_next_round_ms.append((now - self._answer_time) * 1000.0)
+            self._answer_time = None
+
+    def play_requested(self):
+        if not self.enabled:
+            return
+        self._play_start = time.perf_counter()
+        self.instant("play_clicked")
+
+    def first_sound(self, at: Optional[float] = None):
+        # вызывается из аудиопотока после первого блока, отданного устройству;
+        # at — perf_counter() этого момента, если он замерен в другом процессе
+        if not self.enabled or self._play_start is None:
+            return
+        now = time.perf_counter() if at is None else at
+        play_s = now - self._play_start
+        self._play_start = None
+
+        if self._round_ready_s is None:
+            # повторный Play в том же раунде — подготовка уже учтена
+            self.play_to_sound_ms.append(play_s * 1000.0)
+            self.instant("first_sound", ms=round(play_s * 1000.0, 2), repeat=True)
+            return
+
+        ttfs = play_s + self._round_ready_s
+        self._round_ready_s = None
+        self.time_to_first_sound_ms.append(ttfs * 1000.0)
+        self.instant("first_sound", ms=round(ttfs * 1000.0, 2))
+
+    def answer_submitted(self):
+        if not self.enabled:
+            return
+        self._answer_time = time.perf_counter()
+        self.instant("answer_submitted")
+
+    # ── другие процессы ─────────────────────────────────────────────
+
+    def export_events(self) -> dict:
+        return {
+            "t0": self._t0,
+            "pid": self._pid,
+            "threads": dict(self._thread_names),
+            "events": list(self._events),
+        }
+
+    def merge(self, exported: dict, process_name: str):
+        # perf_counter — общий монотонный таймер машины, поэтому метки
+        # другого процесса сдвигаются на разницу t0
+        shift = (exported["t0"] - self._t0) * 1e6
+        for ev in exported["events"]:
+            ev = dict(ev)
+            ev["ts"] += shift
+            # номер раунда дочерний процесс не знает
+            ev.get("args", {}).pop("round", None)
+            self._events.append(ev)
+
+        pid = exported["pid"]
+        self._foreign_meta.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": process_name}})
+        for tid, name in exported["threads"].items():
+            self._foreign_meta.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+
+    # ── отчёт ───────────────────────────────────────────────────────
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.round_id,
+            "time_to_first_sound_ms": _percentiles(self.time_to_first_sound_ms),
+            "play_to_sound_ms": _percentiles(self.play_to_sound_ms),
+            "answer_to_next_round_ms": _percentiles(self.answer_to_next_round_ms),
+        }
+
+    def export_chrome_trace(self, path: str):
+        meta = [
+            {"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self._thread_names.items()
+        ]
+        data = {
+            "traceEvents": meta + self._foreign_meta + list(self._events),
+            "displayTimeUnit": "ms",
+            "otherData": self.stats(),
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def save_report(self, report_dir: str = DEFAULT_REPORT_DIR) -> Optional[str]:
+        if not self.enabled:
+            return None
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = str(Path(report_dir) / f"trace-{stamp}.json")
+        self.export_chrome_trace(path)
+        return path
+
+
+# общий трейсер процесса
+tracer = Tracer(enabled=trace_enabled_from_env())
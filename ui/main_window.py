@@ -12,12 +12,22 @@ from PySide6.QtWidgets import (
     QFileDialog,
     QMessageBox,
     QSlider,
+    QMenu,
 )
 
 from ui.freq_visualizer import FreqVisualizer
+from ui.settings_dialog import SettingsDialog
+from ui.watchdog import EventLoopWatchdog, diag_mode_from_env
 from core.game import Game
-from core.audio_engine import AudioEngine
+from core.audio_engine import resolve_output_device
+from core.dsp_process import create_audio_engine
+from core.loudness import LoudnessIndex
+from core.pcm_cache import PcmCache
+from core.settings import load_settings, save_settings, audio_settings
 from core.utils import find_audio_files, is_audio_file
+from core.signals import SIGNAL_KINDS, create_signal
+from core.story_pack import StoryPack
+from core.tracing import tracer
 
 
 class MainWindow(QMainWindow):
@@ -28,7 +38,13 @@ class MainWindow(QMainWindow):
         self.resize(1200, 700)
 
         self.game = Game()
-        self.audio = AudioEngine()
+        self.settings = load_settings()
+        self.audio = create_audio_engine(
+            audio_settings(self.settings)["engine_mode"],
+            pcm_cache=self._create_pcm_cache(),
+        )
+        self.loudness = self._create_loudness_index()
+        self._apply_audio_settings()
         self._round_active = False
 
         self.mode = "sandbox"  # "sandbox" | "story"
@@ -46,6 +62,11 @@ class MainWindow(QMainWindow):
 
         # папка с треками сюжетки (рядом с app.py)
         self.story_folder = str(Path(__file__).resolve().parents[1] / "songs_story")
+        # собранный пак (python -m core.story_pack build songs_story songs_story.pack);
+        # если он есть — сюжетка играет из него без декодирования
+        self.story_pack_path = self.story_folder + ".pack"
+        self.story_pack: StoryPack | None = None
+        self.story_track_index: int | None = None
 
         self._last_selected_gain_db: float | None = None
         self._last_hover_gain_db: float | None = None
@@ -55,13 +76,44 @@ class MainWindow(QMainWindow):
 
         self.song_files: list[str] = []
         self.current_song_path: str | None = None
+        self.test_signal_kind: str | None = None  # генерируемый сигнал вместо файлов
 
         self._true_gain_db: float | None = None
         self._true_q: float | None = None
 
+        # диагностика лагов UI (по умолчанию выключена)
+        self.watchdog = EventLoopWatchdog(self, mode=diag_mode_from_env())
+
         self._init_ui()
         self._apply_styles()
         self._connect_signals()
+        self.watchdog.start()
+
+    def _create_pcm_cache(self) -> PcmCache | None:
+        try:
+            return PcmCache()
+        except OSError as e:
+            # нет прав на запись — работаем без кэша
+            print(f"[WARN] PCM cache disabled: {e}")
+            return None
+
+    def _create_loudness_index(self) -> LoudnessIndex | None:
+        try:
+            return LoudnessIndex()
+        except OSError as e:
+            print(f"[WARN] loudness analysis disabled: {e}")
+            return None
+
+    def _apply_audio_settings(self):
+        cfg = audio_settings(self.settings)
+        self.audio.configure_output(
+            block_size=cfg["block_size"],
+            device=resolve_output_device(cfg["device"]),
+            target_latency_ms=cfg["target_latency_ms"],
+        )
+        self.audio.set_memory_mode(cfg["memory_mode"])
+        self.audio.set_filter_engine(cfg["filter_engine"])
+        self.audio.set_loudness_match(cfg["loudness_match"], cfg["target_lufs"])
 
     # ── UI ──────────────────────────────────────────────────────────
 
@@ -117,9 +169,19 @@ class MainWindow(QMainWindow):
         self.new_round_button = QPushButton("New Round")
         self.play_button = QPushButton("Play")
         self.ab_button = QPushButton("A / B")
+        self.preview_button = QPushButton("Preview")
+        self.preview_button.setCheckable(True)
+        self.preview_button.setToolTip("В режиме A (ORIG) слышно твою догадку freq+gain под курсором")
         self.load_folder_button = QPushButton("Load Folder...")
         self.load_file_button = QPushButton("Load File...")
 
+        self.test_signal_button = QPushButton("Test Signal")
+        self.test_signal_menu = QMenu(self.test_signal_button)
+        for kind in SIGNAL_KINDS:
+            action = self.test_signal_menu.addAction(kind)
+            action.setData(kind)
+        self.test_signal_button.setMenu(self.test_signal_menu)
+
         self.volume_slider = QSlider(Qt.Horizontal)
         self.volume_slider.setRange(0, 100)
         self.volume_slider.setValue(80)
@@ -131,9 +193,11 @@ class MainWindow(QMainWindow):
         bottom_bar.addWidget(self.play_button)
         bottom_bar.addWidget(self.volume_slider)
         bottom_bar.addWidget(self.ab_button)
+        bottom_bar.addWidget(self.preview_button)
         bottom_bar.addStretch(1)
         bottom_bar.addWidget(self.load_folder_button)
         bottom_bar.addWidget(self.load_file_button)
+        bottom_bar.addWidget(self.test_signal_button)
 
         main_layout.addLayout(bottom_bar)
 
@@ -157,25 +221,75 @@ class MainWindow(QMainWindow):
         """)
 
     def _connect_signals(self):
-        self.visualizer.frequencyHovered.connect(self._on_frequency_hovered)
-        self.visualizer.frequencySelected.connect(self._on_frequency_selected)
-        self.mode_button.clicked.connect(self._on_mode_clicked)
-
-        self.new_round_button.clicked.connect(self._on_new_round_clicked)
-        self.play_button.clicked.connect(self._on_play_clicked)
-        self.ab_button.clicked.connect(self._on_ab_clicked)
-        self.load_folder_button.clicked.connect(self._on_load_folder_clicked)
-        self.load_file_button.clicked.connect(self._on_load_file_clicked)
-        self.volume_slider.valueChanged.connect(self._on_volume_changed)
+        w = self.watchdog.wrap
+
+        self.visualizer.frequencyHovered.connect(w("_on_frequency_hovered", self._on_frequency_hovered))
+        self.visualizer.frequencySelected.connect(w("_on_frequency_selected", self._on_frequency_selected))
+        self.mode_button.clicked.connect(w("_on_mode_clicked", self._on_mode_clicked))
+        self.settings_button.clicked.connect(w("_on_settings_clicked", self._on_settings_clicked))
+
+        self.new_round_button.clicked.connect(w("_on_new_round_clicked", self._on_new_round_clicked))
+        self.play_button.clicked.connect(w("_on_play_clicked", self._on_play_clicked))
+        self.ab_button.clicked.connect(w("_on_ab_clicked", self._on_ab_clicked))
+        self.preview_button.toggled.connect(w("_on_preview_toggled", self._on_preview_toggled))
+        self.load_folder_button.clicked.connect(w("_on_load_folder_clicked", self._on_load_folder_clicked))
+        self.load_file_button.clicked.connect(w("_on_load_file_clicked", self._on_load_file_clicked))
+        self.volume_slider.valueChanged.connect(w("_on_volume_changed", self._on_volume_changed))
+        self.test_signal_menu.triggered.connect(w("_on_test_signal_selected", self._on_test_signal_selected))
+
+    def closeEvent(self, event):
+        print(f"[INFO] audio underruns this session: {self.audio.underruns}")
+        report = self.audio.dsp_report()
+        if report:
+            print(f"[INFO] DSP cost per block: {report}")
+
+        # close() до сохранения трейса: DSP-процессы отдают свои спаны при выходе
+        self.audio.close()
+        if self.loudness is not None:
+            self.loudness.close()
+
+        trace = tracer.save_report()
+        if trace:
+            print(f"[TRACE] {tracer.stats()} -> {trace}")
+
+        self.watchdog.stop()
+        report = self.watchdog.save_report()
+        if report:
+            print(f"[DIAG] report saved: {report}")
+
+        super().closeEvent(event)
 
     # ── handlers ────────────────────────────────────────────────────
 
     def _on_volume_changed(self, value: int):
         self.audio.set_volume(value / 100.0)
 
+    def _on_settings_clicked(self):
+        dialog = SettingsDialog(self.audio, self.settings, self)
+        if dialog.exec() != SettingsDialog.Accepted:
+            return
+
+        self.settings = dialog.updated_settings()
+        try:
+            save_settings(self.settings)
+        except OSError as e:
+            QMessageBox.warning(self, "Freq Trainer", f"Не удалось сохранить настройки: {e}")
+
+        self._apply_audio_settings()
+
+        # новый размер блока применяется при открытии потока — перезапускаем
+        if self.audio.is_playing:
+            self.audio.stop()
+            # умерший DSP-процесс play() не перезапустит — сначала переключаем движок
+            self._check_audio_engine()
+            self.audio.play()
+            self._update_play_button()
+
     def _on_frequency_hovered(self, freq: float, gain_db: float):
         self._last_hover_freq = freq
         self._last_hover_gain_db = gain_db
+        if self.preview_button.isChecked() and self._round_active:
+            self.audio.set_preview(freq, gain_db)
         self.freq_display.setText(
             f"Freq: {freq:,.0f} Hz | Gain: {gain_db:+.1f} dB (range: ±15 dB)".replace(",", " ")
         )
@@ -213,9 +327,20 @@ class MainWindow(QMainWindow):
             self.info_label.setText("Музыку можно включить только во время раунда.")
             return
 
+        self._check_audio_engine()
+        if not self.audio.is_playing:
+            tracer.play_requested()
         self.audio.toggle_play()
         self._update_play_button()
 
+    def _on_preview_toggled(self, checked: bool):
+        if checked:
+            if self._last_hover_freq is not None and self._last_hover_gain_db is not None:
+                self.audio.set_preview(self._last_hover_freq, self._last_hover_gain_db)
+            self.info_label.setText("Preview: в режиме A (ORIG) звучит твоя догадка под курсором.")
+        else:
+            self.audio.clear_preview()
+
     def _on_ab_clicked(self):
         self.audio.toggle_ab()
         mode = "ORIG" if self.audio.is_ab_original else "EQ"
@@ -236,7 +361,9 @@ class MainWindow(QMainWindow):
 
         self.song_files = files
         self.current_song_path = None
+        self.test_signal_kind = None
         self.play_button.setEnabled(True)
+        self._prefetch_loudness(files)
 
         self.info_label.setText(f"Загружено {len(files)} файлов. Запускаю раунд...")
         self._start_new_round()
@@ -260,20 +387,47 @@ class MainWindow(QMainWindow):
 
         self.song_files = []
         self.current_song_path = path
+        self.test_signal_kind = None
         self.play_button.setEnabled(True)
 
         self.info_label.setText(f"Загружен файл: {self._short_song_name()}. Запускаю раунд...")
         self._start_new_round()
 
+    def _on_test_signal_selected(self, action):
+        if self.mode == "story":
+            return
+
+        self.song_files = []
+        self.current_song_path = None
+        self.test_signal_kind = action.data()
+        self.play_button.setEnabled(True)
+
+        self.info_label.setText(f"Тестовый сигнал: {self.test_signal_kind}. Запускаю раунд...")
+        self._start_new_round()
+
     # ── helpers ─────────────────────────────────────────────────────
 
     def _ensure_song_available(self) -> bool:
-        if self.song_files or self.current_song_path:
+        if self.song_files or self.current_song_path or self.test_signal_kind or self.story_pack:
             return True
         self.info_label.setText("Нет файлов для воспроизведения. Загрузите папку или файл.")
         return False
 
+    def _prefetch_loudness(self, paths: list[str]):
+        # анализ громкости идёт в фоне на пуле процессов, раунды его не ждут
+        if self.loudness is not None and paths:
+            self.loudness.prefetch(paths)
+
+    def _apply_track_loudness(self, path: str):
+        info = self.loudness.get(path) if self.loudness is not None else None
+        if info is not None:
+            self.audio.set_track_loudness(info.integrated_lufs, info.true_peak_db)
+
     def _short_song_name(self) -> str:
+        if self.story_pack and self.story_track_index is not None:
+            return self.story_pack.tracks[self.story_track_index].name
+        if self.test_signal_kind and not self.current_song_path:
+            return f"signal: {self.test_signal_kind}"
         if not self.current_song_path:
             return "—"
         return Path(self.current_song_path).name
@@ -282,18 +436,24 @@ class MainWindow(QMainWindow):
         if not self._ensure_song_available():
             return
 
+        tracer.begin_round()
+        with tracer.span("ui.start_new_round", cat="ui", mode=self.mode):
+            if not self._prepare_round():
+                return
+        tracer.round_ready()
+
+    def _prepare_round(self) -> bool:
+        self._check_audio_engine()
         self.audio.stop()
         self._update_play_button()
 
         if self.song_files:
             self.current_song_path = random.choice(self.song_files)
+        if self.story_pack:
+            self.story_track_index = random.randrange(len(self.story_pack))
 
-        if self.current_song_path:
-            try:
-                self.audio.load_file(self.current_song_path)
-            except Exception as e:
-                self.info_label.setText(f"Ошибка загрузки файла: {e}")
-                return
+        if not self._load_round_audio():
+            return False
 
         if self.mode == "story":
             g = self.story_gain_abs_by_level[self.story_level - 1]
@@ -310,6 +470,7 @@ class MainWindow(QMainWindow):
 
         self.audio.is_ab_original = False
         self.audio.set_peaking_eq(true_freq, q=q, gain_db=true_gain_db)
+        self.audio.clear_preview()
 
         self._last_selected_freq = None
         self._last_selected_gain_db = None
@@ -327,6 +488,46 @@ class MainWindow(QMainWindow):
             self.info_label.setText(
                 f"Трек: {self._short_song_name()} | выбери freq+gain и кликни по полосе."
             )
+        return True
+
+    def _load_round_audio(self) -> bool:
+        # загружает в движок уже выбранный трек раунда (пак / файл / сигнал)
+        if self.story_pack and self.story_track_index is not None:
+            # отрывок из пака: без декодера, только view на memmap
+            try:
+                self.audio.load_pack_track(self.story_pack_path, self.story_track_index)
+            except Exception as e:
+                self.info_label.setText(f"Ошибка чтения пака: {e}")
+                return False
+        elif self.current_song_path:
+            try:
+                self.audio.load_file(self.current_song_path)
+            except Exception as e:
+                self.info_label.setText(f"Ошибка загрузки файла: {e}")
+                return False
+            self._apply_track_loudness(self.current_song_path)
+        elif self.test_signal_kind:
+            self.audio.load_source(create_signal(self.test_signal_kind))
+        return True
+
+    def _check_audio_engine(self):
+        # DSP-процесс умер — переходим на потоковый движок и восстанавливаем раунд
+        if self.audio.alive:
+            return
+        print("[WARN] audio process is not running, switching to the thread engine")
+        try:
+            self.audio.close()
+        except Exception as e:
+            print(f"[WARN] closing dead audio engine failed: {e}")
+
+        self.audio = create_audio_engine("thread", pcm_cache=self._create_pcm_cache())
+        self._apply_audio_settings()
+        self.audio.set_volume(self.volume_slider.value() / 100.0)
+        self._update_play_button()
+
+        if self._round_active and self._load_round_audio():
+            self.audio.set_peaking_eq(self.game.current_freq, q=self._true_q, gain_db=self.game.current_gain_db)
+        self.info_label.setText("Аудиопроцесс упал — звук переключён на потоковый движок.")
 
     def _confirm_answer(self):
         if self.game.current_freq is None:
@@ -343,6 +544,7 @@ class MainWindow(QMainWindow):
             return
 
         result = self.game.submit_answer(guess_f, guess_g)
+        tracer.answer_submitted()
 
         self.audio.stop()
         self._update_play_button()
@@ -411,13 +613,18 @@ class MainWindow(QMainWindow):
         self.score_label.setText("SCORE: 0")
         self.combo_label.setText("COMBO: x1.0")
 
-        self.song_files = find_audio_files(self.story_folder)
+        self.story_pack = self._open_story_pack()
+        self.story_track_index = None
+        self.song_files = [] if self.story_pack else find_audio_files(self.story_folder)
         self.current_song_path = None
+        self.test_signal_kind = None
+        self._prefetch_loudness(self.song_files)
 
         self.load_folder_button.hide()
         self.load_file_button.hide()
+        self.test_signal_button.hide()
 
-        if not self.song_files:
+        if not self.song_files and not self.story_pack:
             self.play_button.setEnabled(False)
             self.info_label.setText(
                 f"Сюжетка: нет треков в папке {self.story_folder}. Добавь файлы и перезапусти."
@@ -436,13 +643,26 @@ class MainWindow(QMainWindow):
         self.story_label.setText("")
         self.story_level_complete = False
         self.story_finished = False
+        self.story_pack = None
+        self.story_track_index = None
 
         self.load_folder_button.show()
         self.load_file_button.show()
+        self.test_signal_button.show()
 
         self.info_label.setText("Песочница: загрузите папку или файл с треками.")
         # в sandbox не стартуем автоматически — как ты и хотел ранее
 
+    def _open_story_pack(self) -> StoryPack | None:
+        if not Path(self.story_pack_path).exists():
+            return None
+        try:
+            pack = self.audio.open_pack(self.story_pack_path)
+        except Exception as e:
+            print(f"[WARN] story pack unavailable ({e}), scanning {self.story_folder}")
+            return None
+        return pack if len(pack) else None
+
     def _update_story_label(self):
         if self.mode != "story":
             self.story_label.setText("")
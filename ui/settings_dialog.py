@@ -0,0 +1,236 @@
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import (
+    QApplication,
+    QCheckBox,
+    QComboBox,
+    QDialog,
+    QDialogButtonBox,
+    QDoubleSpinBox,
+    QFormLayout,
+    QLabel,
+    QPushButton,
+    QVBoxLayout,
+)
+
+from core.audio_engine import FILTER_ENGINES, FIR_TAPS, output_devices, resolve_output_device
+from core.calibration import BLOCK_SIZES, calibrate_block_size
+from core.dsp_process import ENGINE_MODES
+from core.sample_format import MEMORY_MODES
+from core.settings import audio_settings
+
+
+class SettingsDialog(QDialog):
+    def __init__(self, audio, settings: dict, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Settings")
+        self.setMinimumWidth(420)
+
+        self.audio = audio
+        self.settings = dict(settings)
+        self._audio_cfg = audio_settings(self.settings)
+
+        self._init_ui()
+        self._load_values()
+
+    def _init_ui(self):
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+
+        self.block_size_combo = QComboBox()
+        for bs in BLOCK_SIZES:
+            self.block_size_combo.addItem(str(bs), bs)
+
+        self.latency_spin = QDoubleSpinBox()
+        self.latency_spin.setRange(0.0, 500.0)
+        self.latency_spin.setDecimals(1)
+        self.latency_spin.setSuffix(" ms")
+        self.latency_spin.setSpecialValueText("Auto")
+
+        self.device_combo = QComboBox()
+        self.device_combo.addItem("System default", None)
+        # в настройках — имя устройства, индекс PortAudio между запусками не стабилен
+        for name in self._output_devices():
+            self.device_combo.addItem(name, name)
+
+        self.margin_spin = QDoubleSpinBox()
+        self.margin_spin.setRange(0.0, 5.0)
+        self.margin_spin.setSingleStep(0.1)
+        self.margin_spin.setDecimals(2)
+
+        self.memory_mode_combo = QComboBox()
+        for mode in MEMORY_MODES:
+            self.memory_mode_combo.addItem(mode, mode)
+
+        self.memory_label = QLabel(self._footprint_text())
+
+        self.engine_combo = QComboBox()
+        for engine in FILTER_ENGINES:
+            self.engine_combo.addItem(engine, engine)
+        self.engine_combo.currentIndexChanged.connect(self._on_engine_changed)
+
+        self.engine_latency_label = QLabel("")
+
+        self.engine_mode_combo = QComboBox()
+        for mode in ENGINE_MODES:
+            self.engine_mode_combo.addItem(mode, mode)
+        self.engine_mode_combo.setToolTip("Применяется после перезапуска")
+
+        self.loudness_check = QCheckBox("Match track and A/B loudness")
+
+        self.target_lufs_spin = QDoubleSpinBox()
+        self.target_lufs_spin.setRange(-40.0, -6.0)
+        self.target_lufs_spin.setDecimals(1)
+        self.target_lufs_spin.setSuffix(" LUFS")
+        self.loudness_check.toggled.connect(self.target_lufs_spin.setEnabled)
+
+        self.underruns_label = QLabel(str(self.audio.underruns))
+
+        form.addRow("Block size:", self.block_size_combo)
+        form.addRow("Target latency:", self.latency_spin)
+        form.addRow("Output device:", self.device_combo)
+        form.addRow("Safety margin:", self.margin_spin)
+        form.addRow("Sample storage:", self.memory_mode_combo)
+        form.addRow("Track memory:", self.memory_label)
+        form.addRow("EQ engine:", self.engine_combo)
+        form.addRow("EQ latency:", self.engine_latency_label)
+        form.addRow("Audio processing:", self.engine_mode_combo)
+        form.addRow("Loudness:", self.loudness_check)
+        form.addRow("Target loudness:", self.target_lufs_spin)
+        form.addRow("Underruns:", self.underruns_label)
+        layout.addLayout(form)
+
+        self.calibrate_button = QPushButton("Auto-calibrate")
+        self.calibrate_button.clicked.connect(self._on_calibrate_clicked)
+        layout.addWidget(self.calibrate_button)
+
+        self.calibration_label = QLabel("")
+        self.calibration_label.setWordWrap(True)
+        self.calibration_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.calibration_label)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def _output_devices(self) -> list[str]:
+        try:
+            devices = output_devices()
+        except Exception as e:
+            print(f"Не удалось получить список устройств: {e}")
+            return []
+        # одно имя может встречаться под разными host API — показываем один раз
+        return list(dict.fromkeys(name for _, name in devices))
+
+    def _load_values(self):
+        cfg = self._audio_cfg
+
+        i = self.block_size_combo.findData(int(cfg["block_size"]))
+        self.block_size_combo.setCurrentIndex(i if i >= 0 else self.block_size_combo.findData(1024))
+
+        self.latency_spin.setValue(float(cfg["target_latency_ms"]))
+
+        i = self.device_combo.findData(cfg["device"])
+        self.device_combo.setCurrentIndex(max(0, i))
+
+        self.margin_spin.setValue(float(cfg["safety_margin"]))
+
+        i = self.memory_mode_combo.findData(cfg["memory_mode"])
+        self.memory_mode_combo.setCurrentIndex(max(0, i))
+
+        i = self.engine_combo.findData(cfg["filter_engine"])
+        self.engine_combo.setCurrentIndex(max(0, i))
+        self._on_engine_changed()
+
+        i = self.engine_mode_combo.findData(cfg["engine_mode"])
+        self.engine_mode_combo.setCurrentIndex(max(0, i))
+
+        self.loudness_check.setChecked(bool(cfg["loudness_match"]))
+        self.target_lufs_spin.setValue(float(cfg["target_lufs"]))
+        self.target_lufs_spin.setEnabled(self.loudness_check.isChecked())
+
+    def _footprint_text(self) -> str:
+        fp = self.audio.memory_footprint()
+        if not fp["bytes"]:
+            return "—"
+        mb = 1024 * 1024
+        return f"{fp['bytes'] / mb:.1f} MB ({fp['dtype']}), float32: {fp['float32_bytes'] / mb:.1f} MB"
+
+    # ── handlers ────────────────────────────────────────────────────
+
+    def _on_engine_changed(self, *_):
+        # линейно-фазовый FIR задерживает сигнал на половину длины фильтра
+        if self.engine_combo.currentData() == "fft-linear":
+            ms = (FIR_TAPS // 2) * 1000.0 / self.audio.samplerate
+            self.engine_latency_label.setText(f"{ms:.1f} ms")
+        else:
+            self.engine_latency_label.setText("0 ms")
+
+    def _on_calibrate_clicked(self):
+        self.calibrate_button.setEnabled(False)
+        self.calibration_label.setText("Калибровка...")
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        QApplication.processEvents()
+
+        # пробный поток не должен делить устройство и GIL с живым воспроизведением
+        # (а на эксклюзивных бэкендах он просто не откроется)
+        was_playing = self.audio.is_playing
+        if was_playing:
+            self.audio.stop()
+
+        try:
+            channels = self.audio.channels
+            latency_ms = self.latency_spin.value()
+            result = calibrate_block_size(
+                lambda: self.audio.make_eq_processor(channels, engine=self.engine_combo.currentData()),
+                samplerate=self.audio.samplerate,
+                channels=channels,
+                safety_margin=self.margin_spin.value(),
+                device=resolve_output_device(self.device_combo.currentData()),
+                latency=latency_ms / 1000.0 if latency_ms > 0 else None,
+            )
+        except Exception as e:
+            self.calibration_label.setText(f"Ошибка калибровки: {e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+            self.calibrate_button.setEnabled(True)
+            if was_playing:
+                self._resume_playback()
+
+        i = self.block_size_combo.findData(result.block_size)
+        if i >= 0:
+            self.block_size_combo.setCurrentIndex(i)
+
+        self.calibration_label.setText(
+            f"Выбран block size: {result.block_size}\n{result.summary()}"
+        )
+
+    def _resume_playback(self):
+        try:
+            self.audio.play()
+        except RuntimeError as e:
+            # аудиопроцесс умер — главное окно сменит движок при следующем Play
+            print(f"[WARN] cannot resume playback after calibration: {e}")
+
+    # ── result ──────────────────────────────────────────────────────
+
+    def values(self) -> dict:
+        return {
+            "block_size": int(self.block_size_combo.currentData()),
+            "target_latency_ms": float(self.latency_spin.value()),
+            "device": self.device_combo.currentData(),
+            "safety_margin": float(self.margin_spin.value()),
+            "memory_mode": self.memory_mode_combo.currentData(),
+            "filter_engine": self.engine_combo.currentData(),
+            "engine_mode": self.engine_mode_combo.currentData(),
+            "loudness_match": self.loudness_check.isChecked(),
+            "target_lufs": float(self.target_lufs_spin.value()),
+        }
+
+    def updated_settings(self) -> dict:
+        settings = dict(self.settings)
+        audio = dict(settings.get("audio") or {})
+        audio.update(self.values())
+        settings["audio"] = audio
+        return settings
@@ -0,0 +1,184 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+from functools import wraps
+from pathlib import Path
+from typing import Callable
+
+from PySide6.QtCore import QObject, QTimer
+
+# включается переменной окружения: FREQ_TRAINER_DIAG=1
+# (FREQ_TRAINER_DIAG=profile — дополнительно cProfile вокруг обработчиков)
+DIAG_ENV = "FREQ_TRAINER_DIAG"
+
+DEFAULT_REPORT_DIR = str(Path(__file__).resolve().parents[1] / "reports")
+
+
+def diag_mode_from_env() -> str:
+    value = os.environ.get(DIAG_ENV, "").strip().lower()
+    if value in ("", "0", "off", "false", "no"):
+        return "off"
+    if value == "profile":
+        return "profile"
+    return "on"
+
+
+class EventLoopWatchdog(QObject):
+    """
+    Диагностика лагов Qt event loop.
+
+    Heartbeat-таймер тикает с фиксированным интервалом; если тик пришёл
+    позже, чем должен, значит главный поток был занят. Обработчики UI
+    оборачиваются через wrap(), поэтому при превышении порога известно,
+    какой из них выполнялся в момент зависания.
+    """
+
+    def __init__(
+        self,
+        parent=None,
+        mode: str = "off",
+        interval_ms: int = 50,
+        stall_threshold_ms: float = 100.0,
+        report_dir: str = DEFAULT_REPORT_DIR,
+    ):
+        super().__init__(parent)
+        self.mode = mode
+        self.enabled = mode != "off"
+        self.profile_enabled = mode == "profile"
+
+        self.interval_ms = int(interval_ms)
+        self.stall_threshold_ms = float(stall_threshold_ms)
+        self.report_dir = Path(report_dir)
+
+        self.stalls: list[dict] = []
+        self.handler_stats: dict[str, dict] = {}
+        self.profiles: list[dict] = []
+        self.max_lag_ms = 0.0
+        self.ticks = 0
+
+        self._session_start = time.time()
+        self._current_handler: str | None = None
+        self._last_handler: str | None = None
+        self._last_handler_end = 0.0
+        self._last_tick = 0.0
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.interval_ms)
+        self._timer.timeout.connect(self._on_heartbeat)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._last_tick = time.perf_counter()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    # ── handlers ────────────────────────────────────────────────────
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        if not self.enabled:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return self._run_tracked(name, fn, *args, **kwargs)
+
+        return wrapper
+
+    def _run_tracked(self, name: str, fn: Callable, *args, **kwargs):
+        prev = self._current_handler
+        self._current_handler = name
+
+        # вложенные вызовы не профилируем — cProfile не поддерживает вложенность
+        profiler = cProfile.Profile() if (self.profile_enabled and prev is None) else None
+        t0 = time.perf_counter()
+        try:
+            if profiler is not None:
+                return profiler.runcall(fn, *args, **kwargs)
+            return fn(*args, **kwargs)
+        finally:
+            t1 = time.perf_counter()
+            dur_ms = (t1 - t0) * 1000.0
+
+            self._current_handler = prev
+            self._last_handler = name
+            self._last_handler_end = t1
+
+            st = self.handler_stats.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+            st["calls"] += 1
+            st["total_ms"] += dur_ms
+            st["max_ms"] = max(st["max_ms"], dur_ms)
+
+            # профиль сохраняем только для медленных вызовов — иначе отчёт раздувается
+            if profiler is not None and dur_ms >= self.stall_threshold_ms:
+                self.profiles.append({
+                    "handler": name,
+                    "duration_ms": round(dur_ms, 2),
+                    "stats": self._format_profile(profiler),
+                })
+
+    def _format_profile(self, profiler: cProfile.Profile, limit: int = 25) -> str:
+        buf = io.StringIO()
+        stats = pstats.Stats(profiler, stream=buf)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return buf.getvalue()
+
+    # ── heartbeat ───────────────────────────────────────────────────
+
+    def _on_heartbeat(self):
+        now = time.perf_counter()
+        lag_ms = (now - self._last_tick) * 1000.0 - self.interval_ms
+        self._last_tick = now
+        self.ticks += 1
+
+        if lag_ms > self.max_lag_ms:
+            self.max_lag_ms = lag_ms
+
+        if lag_ms < self.stall_threshold_ms:
+            return
+
+        # к моменту тика обработчик обычно уже завершился —
+        # берём последний, который закончился внутри окна лага
+        handler = self._current_handler
+        if handler is None and self._last_handler is not None:
+            window_s = (lag_ms + self.interval_ms) / 1000.0
+            if now - self._last_handler_end <= window_s:
+                handler = self._last_handler
+
+        self.stalls.append({
+            "t": round(time.time() - self._session_start, 3),
+            "lag_ms": round(lag_ms, 2),
+            "handler": handler,
+        })
+        print(f"[DIAG] event loop stall {lag_ms:.0f} ms (handler: {handler or '—'})")
+
+    # ── report ──────────────────────────────────────────────────────
+
+    def build_report(self) -> dict:
+        return {
+            "session_start": self._session_start,
+            "duration_s": round(time.time() - self._session_start, 3),
+            "interval_ms": self.interval_ms,
+            "stall_threshold_ms": self.stall_threshold_ms,
+            "ticks": self.ticks,
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "stalls": self.stalls,
+            "handlers": self.handler_stats,
+            "profiles": self.profiles,
+        }
+
+    def save_report(self) -> str | None:
+        if not self.enabled:
+            return None
+
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._session_start))
+        path = self.report_dir / f"diag-{stamp}.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.build_report(), f, ensure_ascii=False, indent=2)
+        return str(path)